@@ -1,15 +1,12 @@
 from buul_backend.settings import FMP_KEY
 
 from django.utils import timezone
-from django.db.models import OuterRef, Subquery
-
-from api.models import StockData, UserInvestmentGraph
-
-from django.db.models import Max
-from django.db.models.functions import ExtractYear, ExtractWeek, \
-    ExtractHour, ExtractDay, ExtractMonth
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from concurrent.futures import ThreadPoolExecutor
+import time
 from datetime import datetime, timedelta
 from dateutil.relativedelta import relativedelta
 from zoneinfo import ZoneInfo
@@ -104,130 +101,56 @@ class FPMUtils:
     
     @classmethod
     def delete_non_closing_times(cls, current_date_rounded, interval):
+        # compaction to each resolution tier lives in the rollup engine
+        from api.tasks.graph import compact_tier
         if interval[1] == "m":
             return
-        if interval[1] == "h":
-            delta = relativedelta(days=1)
-            # kwargs = {
-            #     "date__hour": OuterRef("date__hour"),
-            #     "date__date": OuterRef("date__date")
-            # }
-            latest_stock_data_dates = (
-                StockData.objects
-                .filter(date__lte = current_date_rounded - delta)
-                .annotate(hour=ExtractHour('date'),day=ExtractDay('date'), month=ExtractMonth('date'), year=ExtractYear('date'))
-                .values('hour', 'day', 'month', 'year')
-                .annotate(latest=Max('date'))
-                .values_list('latest', flat=True)
-            )
-            latest_user_graph_dates = (
-                UserInvestmentGraph.objects
-                .filter(date__lte = current_date_rounded - delta)
-                .annotate(hour=ExtractHour('date'),day=ExtractDay('date'), month=ExtractMonth('date'), year=ExtractYear('date'))
-                .values('hour', 'day', 'month', 'year')
-                .annotate(latest=Max('date'))
-                .values_list('latest', flat=True)
-            )
-        elif interval[1] == "d":
-            delta = relativedelta(months=3)
-            # kwargs = {
-            #     "date__date": OuterRef("date__date")
-            # }
-            latest_stock_data_dates = (
-                StockData.objects
-                .filter(date__lte = current_date_rounded - delta)
-                .annotate(day=ExtractDay('date'), month=ExtractMonth('date'), year=ExtractYear('date'))
-                .values('day', 'month', 'year')
-                .annotate(latest=Max('date'))
-                .values_list('latest', flat=True)
-            )
-            latest_user_graph_dates = (
-                UserInvestmentGraph.objects
-                .filter(date__lte = current_date_rounded - delta)
-                .annotate(day=ExtractDay('date'), month=ExtractMonth('date'), year=ExtractYear('date'))
-                .values('day', 'month', 'year')
-                .annotate(latest=Max('date'))
-                .values_list('latest', flat=True)
-            )
-        elif interval[1] == "w":
-            delta = relativedelta(years=1)
-            # kwargs = {
-            #     "date__week": OuterRef("date__week"),
-            #     "date__year": OuterRef("date__year")
-            # }
-            latest_stock_data_dates = (
-                StockData.objects
-                .filter(date__lte = current_date_rounded - delta)
-                .annotate(week=ExtractWeek('date'), year=ExtractYear('date'))
-                .values('week', 'year')
-                .annotate(latest=Max('date'))
-                .values_list('latest', flat=True)
-            )
-            latest_user_graph_dates = (
-                UserInvestmentGraph.objects
-                .filter(date__lte = current_date_rounded - delta)
-                .annotate(week=ExtractWeek('date'), year=ExtractYear('date'))
-                .values('week', 'year')
-                .annotate(latest=Max('date'))
-                .values_list('latest', flat=True)
-            )
-        elif interval[1] == "M":
-            delta = relativedelta(years=5)
-            # kwargs = {
-            #     "date__month": OuterRef("date__month"),
-            #     "date__year": OuterRef("date__year")
-            # }
-            latest_stock_data_dates = (
-                StockData.objects
-                .filter(date__lte = current_date_rounded - delta)
-                .annotate(month=ExtractMonth('date'), year=ExtractYear('date'))
-                .values('month', 'year')
-                .annotate(latest=Max('date'))
-                .values_list('latest', flat=True)
-            )
-            latest_user_graph_dates = (
-                UserInvestmentGraph.objects
-                .filter(date__lte = current_date_rounded - delta)
-                .annotate(month=ExtractMonth('date'), year=ExtractYear('date'))
-                .values('month', 'year')
-                .annotate(latest=Max('date'))
-                .values_list('latest', flat=True)
-            )
-        
-        StockData.objects.filter(
-            date__lte = current_date_rounded - delta
-        ).exclude(
-            date__in = latest_stock_data_dates
-        ).delete()
-
-        UserInvestmentGraph.objects.filter(
-            date__lte = current_date_rounded - delta
-        ).exclude(
-            date__in = latest_user_graph_dates
-        ).delete()
-        # latest_date_subquery = StockData.objects.filter(**kwargs) \
-        #     .order_by("-date").values("date")[:1]
-        # StockData.objects \
-        #     .filter(date__lte = current_date_rounded - delta) \
-        #     .exclude(date=Subquery(latest_date_subquery)) \
-        #     .delete()
-        
-        # latest_date_subquery = UserInvestmentGraph.objects.filter(**kwargs) \
-        #     .order_by("-date").values("date")[:1]
-        # UserInvestmentGraph.objects \
-        #     .filter(date__lte = current_date_rounded - delta) \
-        #     .exclude(date=Subquery(latest_date_subquery)) \
-        #     .delete()
-        return
+        return compact_tier(interval, current_date_rounded)
        
 
+def get_historical_concurrently(client, symbols, start, end, interval, 
+                                max_workers=6, retries=2, backoff=0.5):
+    # fetch every symbol at once, so a refresh costs the slowest symbol.
+    # only dropped connections and timeouts are retried here; 429/5xx 
+    # responses are retried by the session's adapter, and other statuses 
+    # (and an adapter that gave up) fail straight away
+    def fetch(symbol):
+        for attempt in range(retries + 1):
+            try:
+                return client.get_historical(symbol, start, end, interval)
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt == retries:
+                    raise
+                time.sleep(backoff * 2 ** attempt)
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(symbols)))) as executor:
+        responses = executor.map(fetch, symbols)
+        return dict(zip(symbols, responses))
+
+
 class FPMClient:
     root_url = "https://financialmodelingprep.com/stable/"
     possible_intervals = ["1min", "5min", "15min", "30min", "1hour", "4hour"]
     
 
-    def __init__(self, key):
+    def __init__(self, key, max_connections=6, timeout=30):
         self.key = key
+        self.timeout = timeout
+        self.max_connections = max_connections
+        # keep-alive pool shared by every call; pool_block caps concurrent 
+        # connections to the host, and 429/5xx responses are retried with backoff
+        self.session = requests.Session()
+        self.session.mount(self.root_url, HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=max_connections,
+            pool_block=True,
+            max_retries=Retry(
+                total=3,
+                backoff_factor=0.5,
+                status_forcelist=[429, 500, 502, 503, 504],
+                allowed_methods=["GET"]
+            )
+        ))
 
     def get_historical(self, symbol, start, end, interval):
         
@@ -239,7 +162,7 @@ class FPMClient:
            interval_formatted = interval
         if not interval_formatted in self.possible_intervals:
             raise ValueError(f"interval must be in {self.possible_intervals}")
-    
+
     def get_intra_day(self, symbol, start, end, interval):
         if interval[1] == "m":
             interval_formatted = f"{interval[0]}min"
@@ -250,7 +173,7 @@ class FPMClient:
         if not interval_formatted in self.possible_intervals:
             raise ValueError(f"interval must be in {["m", "h"]}")
         
-        response = requests.get(
+        response = self.session.get(
             self.root_url + f"historical-chart/{interval_formatted}",
             params={
                 "from": start.strftime("%Y-%m-%d"),
@@ -258,21 +181,23 @@ class FPMClient:
                 "apikey": self.key,
                 "nonadjusted": False,
                 "symbol": symbol
-            }
+            },
+            timeout=self.timeout
         )
         if response.status_code < 200 or response.status_code > 299:
             raise ConnectionError(f"fpm response has status code {response.status_code}: {response.content}")
         return json.loads(response.content.decode("utf-8"))
 
     def get_eod(self, symbol, start, end):
-        response = requests.get(
+        response = self.session.get(
             self.root_url + f"historical-price-eod/full",
             params={
                 "from": start.strftime("%Y-%m-%d"),
                 "to": end.strftime("%Y-%m-%d"),
                 "apikey": self.key,
                 "symbol": symbol
-            }
+            },
+            timeout=self.timeout
         )
         if response.status_code < 200 or response.status_code > 299:
             raise ConnectionError(f"fpm response has status code {response.status_code}: {response.content}")
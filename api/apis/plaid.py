@@ -1,6 +1,17 @@
 from plaid import ApiClient, Configuration
 from plaid.api import plaid_api
 from buul_backend.settings import PLAID_CLIENT_ID, PLAID_SECRET, PLAID_HOST
+from django.core.cache import cache
+from django.db import connection
+from concurrent.futures import ThreadPoolExecutor
+import contextvars
+import threading
+import time
+
+# items fetched at once per task, and plaid calls per window across all workers
+PLAID_MAX_WORKERS = 5
+PLAID_RATE_BUDGET = 50
+PLAID_RATE_WINDOW = 1
 
 def get_plaid_client():
     """
@@ -20,3 +31,82 @@ def get_plaid_client():
 
 # Singleton instance
 plaid_client = get_plaid_client()
+
+
+def acquire_plaid_budget():
+    # fixed window counter in redis shared by every worker. once a window's 
+    # budget is spent, wait for the next one
+    while True:
+        window = int(time.time() // PLAID_RATE_WINDOW)
+        key = f"plaid_rate_budget_{window}"
+        cache.add(key, 0, timeout=PLAID_RATE_WINDOW * 2)
+        try:
+            used = cache.incr(key)
+        except ValueError:
+            continue # expired between add and incr
+        if used <= PLAID_RATE_BUDGET:
+            return
+        time.sleep(max(0, (window + 1) * PLAID_RATE_WINDOW - time.time()))
+
+def cache_lock(name, timeout):
+    # redis lock in the default cache's keyspace. it holds an owner token, 
+    # and release and extend are compare-and-set scripts, so a run whose lock
+    # expired can't free or extend the lock of the run that took it over
+    client = cache._cache.get_client(write=True)
+    return client.lock(
+        cache.make_and_validate_key(name), timeout=timeout, blocking=False,
+        thread_local=False
+    )
+
+class TokenBucket:
+    # rate permits per second, at most capacity at once, shared by the 
+    # threads of one task
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.capacity, self.tokens + (now - self.updated) * self.rate
+                )
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+def map_plaid_items(func, plaid_items, max_workers=PLAID_MAX_WORKERS):
+    # func(plaid_item) for every item concurrently. func takes the rate 
+    # budget before each plaid call. [(plaid_item, result, error)] in item 
+    # order, so one item failing doesn't lose the others' results
+    def call(plaid_item):
+        try:
+            return plaid_item, func(plaid_item), None
+        except Exception as e:
+            return plaid_item, None, e
+
+    def call_in_worker(plaid_item):
+        try:
+            return call(plaid_item)
+        finally:
+            # the worker thread's own connection, if func used the database
+            connection.close()
+
+    plaid_items = list(plaid_items)
+    if len(plaid_items) <= 1:
+        return [call(plaid_item) for plaid_item in plaid_items]
+    # each worker runs in a copy of the caller's context, which shares its 
+    # secret cache
+    contexts = [contextvars.copy_context() for _ in plaid_items]
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(plaid_items))) as executor:
+        return list(executor.map(
+            lambda context, plaid_item: context.run(call_in_worker, plaid_item),
+            contexts, plaid_items
+        ))
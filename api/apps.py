@@ -21,6 +21,13 @@ class ApiConfig(AppConfig):
                 day_of_month="*",
                 month_of_year="*"
             )
+            crontab_hourly, _ = CrontabSchedule.objects.get_or_create(
+                minute=0,
+                hour="*",
+                day_of_week="*",
+                day_of_month="*",
+                month_of_year="*"
+            )
             crontab_daily, _ = CrontabSchedule.objects.get_or_create(
                 minute=0,
                 hour=0,
@@ -49,24 +56,29 @@ class ApiConfig(AppConfig):
                 },
                 "plaid_access_token_refresh_all": {
                     "kwargs": json.dumps({}),
-                    "crontab": crontab_daily,
+                    "crontab": crontab_hourly,
                     "task_type": "userTasks"
                 },
                 "all_users_spending_by_category": {
                     "kwargs": json.dumps({}),
                     "crontab": crontab_weekly,
                     "task_type": "transactionsTasks"
+                },
+                "anonymize_logs": {
+                    "kwargs": json.dumps({}),
+                    "crontab": crontab_minutely,
+                    "task_type": "anonymizeTasks"
                 }
                 
             }
 
             for task_name in tasks:
                 curr_task_name = task_name
-                # Check if the task already exists, and create it if it doesn't
-                task, created = PeriodicTask.objects.get_or_create(
-                    crontab = tasks[task_name]["crontab"],
+                # Create the task, or update its schedule if it already exists
+                task, created = PeriodicTask.objects.update_or_create(
                     name = task_name,
                     defaults={
+                        "crontab": tasks[task_name]["crontab"],
                         "task": task_name,#f"api.tasks.{tasks[task_name]["task_type"]}.{task_name}",
                         "kwargs": tasks[task_name]["kwargs"]
                     },
@@ -74,7 +86,7 @@ class ApiConfig(AppConfig):
                 if created:
                     print(f"Periodic task '{task_name}' created.")
                 else:
-                    print(f"Periodic task '{task_name}' already exists.")
+                    print(f"Periodic task '{task_name}' updated.")
         except (ProgrammingError, OperationalError):
             # These errors occur during migrations or if the database is not ready
             print(f"Skipping task creation for '{curr_task_name}' due to database readiness issues.")
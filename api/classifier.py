@@ -0,0 +1,51 @@
+import re
+import numpy as np
+
+# a name is cashback if it contains an include keyword and no reject keyword
+KEYWORDS_INCLUDE = [
+    "CASHBACK",
+    "CASH BACK",
+    "CASH AWARD",
+    "CASH REWARD",
+    "CASHREWARD",
+    "CASH REDEMPTION",
+    "CASH AUTO REDEMPTION", # real name
+    "CASHBACK BONUS",
+    "CASHBACK REDEMPTION",
+    "CASHBACK REWARDS",
+    "REWARDS DEPOSIT",
+    "REWARDS CREDIT",
+    "REWARDS REDEMPTION",
+    "STATEMENT CREDIT",
+    "CREDIT- REWARD", # real name
+    "CREDIT REWARD",
+    "WELLS FARGO REWARDS",
+    "CREDIT CRD DES:RWRD"
+]
+KEYWORDS_REJECT = [
+    "ZELLE",
+    "BILL",
+    "CITY",
+    "DIRECT DEP"
+]
+
+# compiled once at import, instead of on every call
+INCLUDE_PATTERN = re.compile("|".join(map(re.escape, KEYWORDS_INCLUDE)))
+REJECT_PATTERN = re.compile("|".join(map(re.escape, KEYWORDS_REJECT)))
+
+
+def is_cashback(name):
+    return INCLUDE_PATTERN.search(name) is not None \
+        and REJECT_PATTERN.search(name) is None
+
+def classify_batch(names):
+    # boolean vector of is_cashback over names (None counts as not cashback)
+    include, reject = INCLUDE_PATTERN.search, REJECT_PATTERN.search
+    return np.fromiter(
+        (
+            name is not None and include(name) is not None and reject(name) is None 
+            for name in names
+        ),
+        dtype=bool,
+        count=len(names)
+    )
@@ -1,12 +1,39 @@
 import types
-from queue import Queue
+import operator
+from collections import deque
 from django.db.utils import OperationalError
 
+OPERATORS = {
+    "eq": operator.eq,
+    "neq": operator.ne,
+    "gt": operator.gt,
+    "lt": operator.lt,
+    "lte": operator.le,
+    "gte": operator.ge
+}
+
+def custom_operation(op):
+    def compare(arg1, arg2):
+        try:
+            return op(arg1, arg2)
+        except Exception as e:
+            if isinstance(e, OperationalError):
+                raise e
+            raise Exception(f"function {op} failed: {str(e)}")
+    return compare
+
+def compile_filter(filter_sets, operations):
+    # [(metric, [(compare, filter_val), ...]), ...] in evaluation order, so 
+    # each json costs one lookup per metric and no operator dispatch
+    plan = []
+    for filter_set, op in zip(filter_sets, operations):
+        compare = OPERATORS[op] if isinstance(op, str) else custom_operation(op)
+        for metric in filter_set:
+            plan.append((metric, [(compare, val) for val in filter_set[metric]]))
+    return plan
+
 def filter_jsons(jsons, eq={}, neq={}, gt={}, lt={}, lte={}, gte={}, metric_to_return_by=None,
                  **kwargs):
-    # import pdb
-    # breakpoint()
-
     # create pairings of ops, 
     # and filtersets which describe the attribute and value for the op 
     filter_sets = [eq, neq, gt, lt, lte, gte]
@@ -24,6 +51,7 @@ def filter_jsons(jsons, eq={}, neq={}, gt={}, lt={}, lte={}, gte={}, metric_to_r
         else:
             return {"error": "kwargs must each be a dict with a function 'func' " + \
                     "and a 'filter_set' of same format as eq, lt, etc"}
+    plan = compile_filter(filter_sets, operations)
 
     if metric_to_return_by:
         filtered_jsons = {}
@@ -31,28 +59,26 @@ def filter_jsons(jsons, eq={}, neq={}, gt={}, lt={}, lte={}, gte={}, metric_to_r
         filtered_jsons = []
     
     for json in jsons:
-        match = True # use the first match found from BFS
-        for filter_set, op in zip(filter_sets, operations):
-            for metric in filter_set:
-                # BFS for the desired metric
-                filter_vals = filter_set[metric]
-                metric_val = get_nested(json, metric)
-                if metric_val is None:
-                    continue
-                # check if op(metric, ) matches all of the provided vals
-                for filter_val in filter_vals:
-                    try:
-                        # ALL must match
-                        if not comparison_operation(metric_val, filter_val, op): 
-                            match = False
-                            break
-                    except Exception as e:
-                        if isinstance(e, OperationalError):
-                            raise e
-                        return {"error": f"comparison operation failed: {str(e)}"}
-                
-                if not match:
-                    break
+        # metrics missing from the json (None) don't filter it out
+        match = True
+        values = {}
+        for metric, checks in plan:
+            if metric in values:
+                metric_val = values[metric]
+            else:
+                metric_val = values[metric] = lookup(json, metric)
+            if metric_val is None:
+                continue
+            try:
+                # ALL must match
+                for compare, filter_val in checks:
+                    if not compare(metric_val, filter_val):
+                        match = False
+                        break
+            except Exception as e:
+                if isinstance(e, OperationalError):
+                    raise e
+                return {"error": f"comparison operation failed: {str(e)}"}
             if not match:
                 break
         
@@ -69,7 +95,7 @@ def filter_jsons(jsons, eq={}, neq={}, gt={}, lt={}, lte={}, gte={}, metric_to_r
 def append_json_to_filter_jsons(metric_to_return_by, filtered_jsons, json):
     if metric_to_return_by:
         try:
-            key = get_nested(json, metric_to_return_by)
+            key = lookup(json, metric_to_return_by)
             if key in filtered_jsons:
                 filtered_jsons[key].append(json)
             else:
@@ -81,37 +107,21 @@ def append_json_to_filter_jsons(metric_to_return_by, filtered_jsons, json):
     else:
         filtered_jsons.append(json)
 
-def comparison_operation(arg1, arg2, op):        
-    if op == "eq":
-        return arg1 == arg2
-    if op == "neq":
-        return arg1 != arg2
-    elif op == "gt":
-        return arg1 > arg2
-    elif op == "lt":
-        return arg1 < arg2
-    elif op == "lte":
-        return arg1 <= arg2
-    elif op == "gte":
-        return arg1 >= arg2
-    elif isinstance(op, types.FunctionType):
-        try:
-            return op(arg1, arg2)
-        except Exception as e:
-            if isinstance(e, OperationalError):
-                raise e
-            raise Exception(f"function {op} failed: {str(e)}")
-    else:
-        raise Exception(f"no such operation: {op}")
+def lookup(json, key):
+    # get_nested, without the search when the key is at the top level
+    if isinstance(json, dict) and key in json:
+        return json[key]
+    return get_nested(json, key)
 
 def get_nested(json, key):
-    queue = Queue()
-    queue.put(json)
-    while queue.qsize() > 0:
-        current = queue.get()
+    # the first key found breadth first. re-checking that a cached path is 
+    # still the first match costs as much as the search, so nothing is cached
+    queue = deque([json])
+    while queue:
+        current = queue.popleft()
         for key_ in current:
             if key_ == key:
                 return current[key]
             if isinstance(current[key_], dict):
-                queue.put(current[key_])
+                queue.append(current[key_])
     return
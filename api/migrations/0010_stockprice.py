@@ -0,0 +1,83 @@
+# Generated by Django 5.2.1 on 2026-10-18 15:44
+
+from django.db import migrations, models
+
+
+create_partitioned_table = """
+CREATE TABLE "api_stockprice" (
+    "symbol" varchar(32) NOT NULL,
+    "interval" varchar(8) NULL,
+    "date" timestamp with time zone NOT NULL,
+    "close" double precision NOT NULL,
+    PRIMARY KEY ("symbol", "date")
+) PARTITION BY RANGE ("date");
+
+CREATE TABLE "api_stockprice_default" PARTITION OF "api_stockprice" DEFAULT;
+
+DO $$
+DECLARE
+    month timestamptz := date_trunc(
+        'month', COALESCE((SELECT min("date") FROM "api_stockdata"), now())
+    );
+BEGIN
+    WHILE month <= date_trunc('month', now()) + interval '1 month' LOOP
+        EXECUTE format(
+            'CREATE TABLE IF NOT EXISTS %I PARTITION OF "api_stockprice" FOR VALUES FROM (%L) TO (%L)',
+            'api_stockprice_p' || to_char(month, 'YYYYMM'),
+            month,
+            month + interval '1 month'
+        );
+        month := month + interval '1 month';
+    END LOOP;
+END $$;
+"""
+
+copy_stock_data = """
+INSERT INTO "api_stockprice" ("symbol", "interval", "date", "close")
+SELECT prices.symbol, NULL, stock_data."date", prices.close
+FROM "api_stockdata" stock_data
+CROSS JOIN LATERAL (VALUES
+    ('VOO', stock_data."VOO"),
+    ('VOOG', stock_data."VOOG"),
+    ('QQQ', stock_data."QQQ"),
+    ('IBIT', stock_data."IBIT"),
+    ('BTC', stock_data."BTC"),
+    ('BTCUSD', stock_data."BTCUSD")
+) AS prices(symbol, close)
+WHERE prices.close IS NOT NULL
+ON CONFLICT DO NOTHING;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_userinvestmentgraphcheckpoint'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.CreateModel(
+                    name='StockPrice',
+                    fields=[
+                        ('pk', models.CompositePrimaryKey('symbol', 'date', blank=True, editable=False, primary_key=True, serialize=False)),
+                        ('symbol', models.CharField(max_length=32)),
+                        ('interval', models.CharField(default=None, max_length=8, null=True)),
+                        ('date', models.DateTimeField()),
+                        ('close', models.FloatField()),
+                    ],
+                    options={
+                        'ordering': ['symbol', 'date'],
+                    },
+                ),
+            ],
+            database_operations=[
+                migrations.RunSQL(
+                    create_partitioned_table,
+                    reverse_sql='DROP TABLE "api_stockprice";'
+                ),
+            ],
+        ),
+        migrations.RunSQL(copy_stock_data, reverse_sql=migrations.RunSQL.noop),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 5.2.1 on 2026-10-18 15:59
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def dedupe_loganonplaid(apps, schema_editor):
+    # counts are recomputed by the anonymize task, keep one row per user
+    LogAnonPlaid = apps.get_model("api", "LogAnonPlaid")
+    keep = LogAnonPlaid.objects.values("user").annotate(min_id=models.Min("id"))
+    LogAnonPlaid.objects.exclude(
+        id__in=[row["min_id"] for row in keep]
+    ).delete()
+
+
+def seed_anonymize_watermarks(apps, schema_editor):
+    # rows up to here were anonymized by the save() overrides the task 
+    # replaces, so it starts after them
+    TaskCheckpoint = apps.get_model("api", "TaskCheckpoint")
+    checkpoint, _ = TaskCheckpoint.objects.get_or_create(name="anonymize")
+    for model_name in ["Log", "Investment"]:
+        model = apps.get_model("api", model_name)
+        seen = model.objects.aggregate(seen=models.Max("id"))["seen"] or 0
+        checkpoint.state.setdefault(model_name, {"done": seen, "seen": seen})
+    checkpoint.save()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_taskcheckpoint'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='loganon',
+            name='date',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.RunPython(dedupe_loganonplaid, migrations.RunPython.noop),
+        migrations.RunPython(seed_anonymize_watermarks, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='loganonplaid',
+            name='user',
+            field=models.CharField(unique=True),
+        ),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 5.2.1 on 2026-10-18 16:04
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_anonymize_pipeline'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='plaiditem',
+            name='categorySpendingSince',
+            field=models.DateField(default=None, null=True),
+        ),
+        migrations.CreateModel(
+            name='PlaidCategorizedTransaction',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('transaction_id', models.CharField(max_length=255)),
+                ('category', models.CharField(max_length=255)),
+                ('date', models.DateField()),
+                ('amount', models.FloatField()),
+                ('item', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='api.plaiditem')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['item', 'category', 'date'], name='api_plaidca_item_id_8a0feb_idx')],
+                'constraints': [models.UniqueConstraint(fields=('item', 'transaction_id'), name='unique_plaid_categorized_transaction')],
+            },
+        ),
+        migrations.CreateModel(
+            name='PlaidCategorySpending',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('category', models.CharField(max_length=255)),
+                ('date', models.DateField()),
+                ('amount', models.FloatField()),
+                ('transactions', models.IntegerField()),
+                ('item', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='api.plaiditem')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', 'date'], name='api_plaidca_user_id_82eb18_idx')],
+                'constraints': [models.UniqueConstraint(fields=('item', 'category', 'date'), name='unique_plaid_category_spending')],
+            },
+        ),
+    ]
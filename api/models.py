@@ -1,4 +1,4 @@
-from django.db import models
+from django.db import models, connection
 from django.contrib.postgres.fields import ArrayField
 from django.contrib.auth.models import AbstractUser
 from django.core.validators import RegexValidator
@@ -6,6 +6,8 @@ from .serializers.plaid.link import e164_phone_number_validator
 import uuid
 import json
 from django.utils import timezone
+from dateutil.relativedelta import relativedelta
+from zoneinfo import ZoneInfo
 from django_celery_results.models import TaskResult
 from buul_backend.encryption import encrypt, decrypt
 from buul_backend.settings import RH_ACCESS_KMS_ALIAS, \
@@ -13,6 +15,7 @@ from buul_backend.settings import RH_ACCESS_KMS_ALIAS, \
     USER_PII_KMS_ALIAS, ANONYMIZE_USER_HMAC_KEY
 import hmac
 import hashlib
+import numpy as np
 
 # Create your models here.
 
@@ -30,6 +33,17 @@ import hashlib
 #     ('fidelity', 'fidelity')
 # ]
 
+def hmac_user_ids(user_ids):
+    # one hmac per distinct user, for anonymizing a batch of rows
+    return {
+        user_id: hmac.new(
+            key=ANONYMIZE_USER_HMAC_KEY.encode(),
+            msg=str(user_id).encode(),
+            digestmod=hashlib.sha256
+        ).hexdigest()
+        for user_id in set(user_ids) if user_id is not None
+    }
+
 class User(AbstractUser):
     # if we must encrypt we can encrypt but have prefix. 
     # so range search on prefix, scan the rest
@@ -58,7 +72,8 @@ class LogAnon(models.Model):
     name = models.CharField()
     method = models.CharField()
     user = models.CharField(default=None, null=True)
-    date = models.DateTimeField(auto_now_add=True)
+    # copied from the source log, which is anonymized after the fact
+    date = models.DateTimeField(default=timezone.now)
     errors = models.JSONField(default=None, null=True)
     state = models.CharField()
     status = models.IntegerField()
@@ -87,25 +102,14 @@ class Log(models.Model):
             models.Index(fields=['user', 'date', 'status', 'state'])
         ]
     
-    def save(self, *args, **kwargs):
-        super().save(*args, **kwargs)
-
-        # import pdb
-        # breakpoint()
-
-        user_hmac = self.user and hmac.new(
-            key=ANONYMIZE_USER_HMAC_KEY.encode(),
-            msg=str(self.user.id).encode(),
-            digestmod=hashlib.sha256
-        ).hexdigest()
-
+    def anonymized(self, user_hmac):
         pre_account_id_hmac = self.pre_account_id and hmac.new(
             key=ANONYMIZE_USER_HMAC_KEY.encode(),
             msg=str(self.pre_account_id).encode(),
             digestmod=hashlib.sha256
         ).hexdigest()
 
-        log_anonymized = LogAnon(
+        return LogAnon(
             name = self.name,
             method = self.method,
             user = user_hmac,
@@ -115,7 +119,6 @@ class Log(models.Model):
             status = self.status,
             pre_account_id = pre_account_id_hmac
         )
-        log_anonymized.save()
 
 class WaitlistEmail(models.Model):
     email = models.EmailField(primary_key=True)
@@ -145,6 +148,12 @@ class UserInvestmentGraph(models.Model):
             )
         ]
 
+class UserInvestmentGraphCheckpoint(models.Model):
+    # last materialized UserInvestmentGraph date and the holdings as of then
+    user = models.OneToOneField(User, on_delete=models.CASCADE, unique=True)
+    date = models.DateTimeField()
+    holdings = models.JSONField(default=dict)
+
 class StockData(models.Model):
     VOO = models.FloatField(null=True, default=None)
     VOOG = models.FloatField(null=True, default=None)
@@ -164,6 +173,67 @@ class StockData(models.Model):
         setattr(self, key, value)
         # self.save()
 
+class StockPriceQuerySet(models.QuerySet):
+    def price_matrix(self, symbols):
+        # wide view of the long store, as StockData used to be: one row per date 
+        # (ascending), one column per symbol, NaN where a symbol has no price
+        rows = self.filter(symbol__in=symbols).order_by("date") \
+            .values_list("date", "symbol", "close")
+        dates, date_index = [], {}
+        row_index = np.empty(len(rows), dtype=np.intp)
+        column_index = np.empty(len(rows), dtype=np.intp)
+        closes = np.empty(len(rows), dtype=float)
+        column = {symbol: i for i, symbol in enumerate(symbols)}
+        for i, (date, symbol, close) in enumerate(rows):
+            if date not in date_index:
+                date_index[date] = len(dates)
+                dates.append(date)
+            row_index[i] = date_index[date]
+            column_index[i] = column[symbol]
+            closes[i] = close
+        prices = np.full((len(dates), len(symbols)), np.nan)
+        prices[row_index, column_index] = closes
+        return dates, prices
+
+class StockPrice(models.Model):
+    # long-format price store, range-partitioned by month on date in postgres
+    # (see migration 0010). interval is the feed interval the bar came from, 
+    # None for bars copied from StockData or forward filled
+    pk = models.CompositePrimaryKey("symbol", "date")
+    symbol = models.CharField(max_length=32)
+    interval = models.CharField(max_length=8, null=True, default=None)
+    date = models.DateTimeField()
+    close = models.FloatField()
+
+    objects = StockPriceQuerySet.as_manager()
+
+    class Meta:
+        ordering = ['symbol', 'date']
+
+    @classmethod
+    def ensure_partitions(cls, start_date, end_date):
+        # monthly partitions covering [start_date, end_date]; anything outside
+        # them lands in the default partition
+        table = cls._meta.db_table
+        month = start_date.astimezone(ZoneInfo("UTC")) \
+            .replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+        with connection.cursor() as cursor:
+            while month <= end_date:
+                next_month = month + relativedelta(months=1)
+                cursor.execute(
+                    f'CREATE TABLE IF NOT EXISTS "{table}_p{month:%Y%m}" '
+                    f'PARTITION OF "{table}" FOR VALUES FROM (%s) TO (%s)',
+                    [month, next_month]
+                )
+                month = next_month
+
+class TaskCheckpoint(models.Model):
+    # where a periodic task left off (watermarks, cursors), so each run only 
+    # picks up what changed since the last one
+    name = models.CharField(max_length=255, unique=True)
+    state = models.JSONField(default=dict)
+    updated_at = models.DateTimeField(auto_now=True)
+
 class PlaidUser(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, unique=True)
     countryCodes = models.CharField(choices=[], max_length=2, null=True, default=None) # create a class with these choices in serializers?
@@ -191,7 +261,7 @@ class PlaidUser(models.Model):
                 "userTokenDek", alias=PLAID_USER_KMS_ALIAS)
 
 class LogAnonPlaid(models.Model):
-    user = models.CharField()
+    user = models.CharField(unique=True)
     items = models.IntegerField()
 
 class PlaidItem(models.Model):
@@ -208,6 +278,8 @@ class PlaidItem(models.Model):
     accessTokenDek = models.BinaryField()
     previousRefresh = models.DateTimeField(auto_now=True)
     transactionsCursor = models.CharField(max_length=255, null=True, default=None)
+    # the category spending ledger has every transaction from this date on
+    categorySpendingSince = models.DateField(null=True, default=None)
     update_code = models.CharField(max_length=255, null=True, default=None)
     institution_name = models.CharField(max_length=255, null=True, default=None)
     institution_id = models.CharField(max_length=255, null=True, default=None)
@@ -220,32 +292,6 @@ class PlaidItem(models.Model):
             )
         ]
     
-    def save(self, *args, **kwargs):
-        super().save(*args, **kwargs)
-
-        # import pdb
-        # breakpoint()
-
-        user_hmac = self.user and hmac.new(
-            key=ANONYMIZE_USER_HMAC_KEY.encode(),
-            msg=str(self.user.id).encode(),
-            digestmod=hashlib.sha256
-        ).hexdigest()
-
-        try:
-            log_plaid_anonymized = LogAnonPlaid.objects.get(user = user_hmac)
-            log_plaid_anonymized.items += 1
-            log_plaid_anonymized.save()
-        except:
-            log_plaid_anonymized = LogAnonPlaid(
-                user = user_hmac,
-                items = 1
-            )
-            log_plaid_anonymized.save()
-
-        
-
-    
     def __init__(self, *args, **kwargs):
         accessToken = kwargs.pop('accessToken', None)
         super().__init__(*args, **kwargs)
@@ -278,6 +324,46 @@ class PlaidPersonalFinanceCategories(models.Model):
     def __setitem__(self, key, value):
         setattr(self, key, value)
 
+class PlaidCategorizedTransaction(models.Model):
+    # transactions counted towards a spending category, kept so modified and 
+    # removed transactions can be taken back out of the daily totals
+    item = models.ForeignKey(PlaidItem, on_delete=models.CASCADE)
+    transaction_id = models.CharField(max_length=255)
+    category = models.CharField(max_length=255)
+    date = models.DateField()
+    amount = models.FloatField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['item', 'transaction_id'], 
+                name='unique_plaid_categorized_transaction'
+            )
+        ]
+        indexes = [
+            models.Index(fields=['item', 'category', 'date'])
+        ]
+
+class PlaidCategorySpending(models.Model):
+    # daily spending per item and category, summed from the ledger above
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    item = models.ForeignKey(PlaidItem, on_delete=models.CASCADE)
+    category = models.CharField(max_length=255)
+    date = models.DateField()
+    amount = models.FloatField()
+    transactions = models.IntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['item', 'category', 'date'], 
+                name='unique_plaid_category_spending'
+            )
+        ]
+        indexes = [
+            models.Index(fields=['user', 'date'])
+        ]
+
 
 # investment models
 
@@ -394,26 +480,14 @@ class Investment(models.Model):
             models.Index(fields=['user', 'date'])
         ]
     
-    def save(self, *args, **kwargs):
-        super().save(*args, **kwargs)
-
-        # import pdb
-        # breakpoint()
-
-        user_hmac = hmac.new(
-            key=ANONYMIZE_USER_HMAC_KEY.encode(),
-            msg=str(self.user.id).encode(),
-            digestmod=hashlib.sha256
-        ).hexdigest()
-
-        logAnonInvestment = LogAnonInvestment(
+    def anonymized(self, user_hmac):
+        return LogAnonInvestment(
             user = user_hmac,
             symbol = self.symbol,
             quantity = self.quantity,
             buy = self.buy,
             date = self.date.date()
         )
-        logAnonInvestment.save()
 
 
 class PlaidLinkWebhook(models.Model):
@@ -74,6 +74,11 @@ class MyTokenRefreshSerializer(TokenRefreshSerializer):
 
 class GraphDataRequestSerializer(serializers.Serializer):
     start_date = serializers.DateTimeField()
+    resolution = serializers.ChoiceField(
+        required=False,
+        choices=["1m", "1h", "1d", "1w", "1M"]
+    )
+    max_points = serializers.IntegerField(min_value=3, max_value=5000, required=False)
 
 class UserSerializer(serializers.ModelSerializer):
     password = serializers.RegexField(
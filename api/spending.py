@@ -0,0 +1,70 @@
+from datetime import date
+from operator import itemgetter
+import numpy as np
+
+# plaid's detailed personal finance categories -> the buul categories
+# spending is reported in
+PLAID_CATEGORY_DETAIL_TO_BUUL_CATEGORIES = {
+    "FOOD_DRINK_AND_COFFEE": "dining",
+    "FOOD_DRINK_AND_FAST_FOOD": "dining",
+    "FOOD_AND_DRINK_RESTAURANT": "dining",
+    "FOOD_AND_DRINK_GROCERIES": "groceries",
+    "RENT_AND_UTILITIES_WATER": "utilities",
+    "RENT_AND_UTILITIES_TELEPHONE": "utilities",
+    "RENT_AND_UTILITIES_SEWAGE_AND_WASTE_TREATMENT": "utilities",
+    "RENT_AND_UTILITIES_INTERNET_AND_CABLE": "utilities",
+    "RENT_AND_UTILITIES_GAS_AND_ELECTRICITY": "utilities",
+    "TRAVEL_FLIGHTS": "travel",
+    "TRAVEL_LODGING": "travel"
+}
+
+
+def transaction_category(transaction):
+    # the buul category a transaction counts towards, or None for pending
+    # transactions, refunds and categories we don't track
+    if transaction["pending"] == True or transaction["amount"] < 0:
+        return None
+    detailed = (transaction.get("personal_finance_category") or {}).get("detailed")
+    return PLAID_CATEGORY_DETAIL_TO_BUUL_CATEGORIES.get(detailed, None)
+
+def transactions_of(transactions_response, transactions_sync=True):
+    # the transactions of a {item_id: {page: page}} response from
+    # transactions_sync or transactions_get, in page order
+    transactions_key = "added" if transactions_sync else "transactions"
+    return [
+        transaction
+        for item in transactions_response.values()
+        for page in item.values()
+        for transaction in page[transactions_key]
+    ]
+
+def spending_by(transactions, key=transaction_category):
+    # ({key: amount spent}, first date, last date) over plaid transactions.
+    # pending transactions and refunds aren't spending. transactions whose
+    # key is None count towards the dates but no group. columnar: amounts
+    # and pending flags are read into arrays, and only the spending rows'
+    # dates and keys are read after them, then grouped with bincount
+    n = len(transactions)
+    amounts = np.fromiter(map(itemgetter("amount"), transactions), dtype=float, count=n)
+    pending = np.fromiter(map(itemgetter("pending"), transactions), dtype=bool, count=n)
+    spent = np.flatnonzero(~pending & (amounts >= 0))
+    if not len(spent):
+        return {}, None, None
+    rows = list(map(transactions.__getitem__, spent.tolist()))
+
+    keys = list(map(key, rows))
+    groups = list(dict.fromkeys(keys))
+    code_of = {group: code for code, group in enumerate(groups)}
+    codes = np.fromiter(map(code_of.__getitem__, keys), dtype=np.intp, count=len(rows))
+    # bincount adds each group's amounts in row order
+    sums = np.bincount(codes, weights=amounts[spent], minlength=len(groups))
+    spending = {
+        group: float(sums[code]) for code, group in enumerate(groups)
+        if group is not None
+    }
+    days = np.fromiter(
+        map(date.toordinal, map(itemgetter("date"), rows)), 
+        dtype=np.int64, count=len(rows)
+    )
+    return spending, date.fromordinal(int(np.minimum.reduce(days))), \
+        date.fromordinal(int(np.maximum.reduce(days)))
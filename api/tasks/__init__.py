@@ -3,4 +3,5 @@ from .graph import *
 from .invest import *
 from .identify import *
 from .user import *
+from .anonymize import *
 from .shared_utilities import *
\ No newline at end of file
@@ -0,0 +1,110 @@
+from celery import shared_task
+from django.db import transaction
+from django.db.models import Count, Max
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from ..models import Log, LogAnon, Investment, LogAnonInvestment, PlaidItem, \
+    LogAnonPlaid, TaskCheckpoint, hmac_user_ids
+
+from buul_backend.retry_db import retry_on_db_error
+
+from datetime import datetime, timedelta
+
+
+ANONYMIZE_BATCH_SIZE = 1000
+# how far back each run looks past the previous one for saved plaid items
+ANONYMIZE_PLAID_ITEMS_OVERLAP = timedelta(minutes=5)
+
+
+# anonymized tables are derived from the source tables in batches,
+# instead of being written by every save of the source models
+
+def anonymize_rows(model, anon_model, checkpoint):
+    # rows are anonymized up to the highest id seen on the previous run,
+    # so rows from transactions still in flight then have since committed
+    # seeded by migration 0012 past the rows anonymized on save, otherwise
+    # every row is anonymized
+    watermark = checkpoint.state.get(model.__name__, {"done": 0, "seen": 0})
+
+    anonymized = 0
+    while watermark["done"] < watermark["seen"]:
+        rows = list(
+            model.objects.filter(
+                id__gt=watermark["done"],
+                id__lte=watermark["seen"]
+            ).order_by("id")[:ANONYMIZE_BATCH_SIZE]
+        )
+        if not rows:
+            break
+        user_hmacs = hmac_user_ids([row.user_id for row in rows])
+        with transaction.atomic():
+            anon_model.objects.bulk_create(
+                [row.anonymized(user_hmacs.get(row.user_id)) for row in rows]
+            )
+            watermark["done"] = rows[-1].id
+            checkpoint.state[model.__name__] = watermark
+            checkpoint.save(update_fields=["state", "updated_at"])
+        anonymized += len(rows)
+
+    watermark["seen"] = model.objects.aggregate(seen=Max("id"))["seen"] or 0
+    watermark["done"] = min(watermark["done"], watermark["seen"])
+    checkpoint.state[model.__name__] = watermark
+    checkpoint.save(update_fields=["state", "updated_at"])
+    return anonymized
+
+def anonymize_plaid_item_counts(user_ids):
+    # recount the items of user_ids. users with none left count 0
+    user_ids = set(user_ids)
+    counts = dict(
+        PlaidItem.objects.filter(user_id__in=user_ids).values("user_id") \
+            .annotate(items=Count("id")).values_list("user_id", "items")
+    )
+    user_hmacs = hmac_user_ids(user_ids)
+    LogAnonPlaid.objects.bulk_create(
+        [
+            LogAnonPlaid(user=user_hmacs[user_id], items=counts.get(user_id, 0))
+            for user_id in user_ids
+        ],
+        update_conflicts=True,
+        unique_fields=["user"],
+        update_fields=["items"]
+    )
+    return len(user_ids)
+
+def anonymize_changed_plaid_items(checkpoint):
+    # users whose items were saved since the last run. runs overlap by 
+    # ANONYMIZE_PLAID_ITEMS_OVERLAP, so saves that committed late are still
+    # picked up. deleted items are recounted as the delete commits
+    now = timezone.now()
+    since = checkpoint.state.get("PlaidItem")
+    items = PlaidItem.objects.all()
+    if since is not None:
+        items = items.filter(
+            previousRefresh__gte=datetime.fromisoformat(since) \
+                - ANONYMIZE_PLAID_ITEMS_OVERLAP
+        )
+    user_ids = list(items.values_list("user_id", flat=True).distinct())
+    for i in range(0, len(user_ids), ANONYMIZE_BATCH_SIZE):
+        anonymize_plaid_item_counts(user_ids[i:i + ANONYMIZE_BATCH_SIZE])
+    checkpoint.state["PlaidItem"] = now.isoformat()
+    checkpoint.save(update_fields=["state", "updated_at"])
+    return len(user_ids)
+
+@receiver(post_delete, sender=PlaidItem)
+def anonymize_deleted_plaid_item(sender, instance, **kwargs):
+    user_id = instance.user_id
+    transaction.on_commit(lambda: anonymize_plaid_item_counts([user_id]))
+
+@shared_task(name="anonymize_logs")
+@retry_on_db_error
+def anonymize_logs():
+    checkpoint, _ = TaskCheckpoint.objects.get_or_create(name="anonymize")
+    return {
+        "LogAnon": anonymize_rows(Log, LogAnon, checkpoint),
+        "LogAnonInvestment": anonymize_rows(
+            Investment, LogAnonInvestment, checkpoint
+        ),
+        "LogAnonPlaid": anonymize_changed_plaid_items(checkpoint)
+    }
@@ -9,7 +9,8 @@ from django.db.models.signals import post_save
 from django.db.models import Sum
 from django.db import transaction
 
-from api.apis.plaid import plaid_client
+from api.apis.plaid import plaid_client, map_plaid_items, \
+    acquire_plaid_budget
 from ..jsonUtils import filter_jsons
 
 from datetime import datetime, timedelta
@@ -42,10 +43,10 @@ from buul_backend.retry_db import retry_on_db_error
 def plaid_accounts_get(uid, item_id=None, balance_ids_by_item_id={}):
     try:
         plaidItems = PlaidItem.objects.filter(user__id=uid)
-        accounts_get_by_item = {}
-        for plaidItem in plaidItems:
-            if item_id and item_id != plaidItem.itemId:
-                continue
+        if item_id:
+            plaidItems = plaidItems.filter(itemId=item_id)
+
+        def accounts_get(plaidItem):
             if plaidItem.itemId in balance_ids_by_item_id:
                 exchange_request = AccountsGetRequest(
                     access_token=plaidItem.accessToken,
@@ -56,13 +57,19 @@ def plaid_accounts_get(uid, item_id=None, balance_ids_by_item_id={}):
                     access_token=plaidItem.accessToken
                 )
         
+            acquire_plaid_budget()
             exchange_response = plaid_client.accounts_get(exchange_request)
             serializer = AccountsGetResponseSerializer(
                 data=exchange_response.to_dict()
             )
             serializer.is_valid(raise_exception=True)
+            return serializer.validated_data
 
-            accounts_get_by_item[plaidItem.itemId] = serializer.validated_data
+        accounts_get_by_item = {}
+        for plaidItem, accounts, error in map_plaid_items(accounts_get, plaidItems):
+            if error:
+                raise error
+            accounts_get_by_item[plaidItem.itemId] = accounts
         return accounts_get_by_item
     except ApiException as e:
         error = json.loads(e.body)
@@ -77,10 +84,10 @@ def plaid_accounts_get(uid, item_id=None, balance_ids_by_item_id={}):
 def plaid_balance_get(uid, item_id=None, account_ids_by_item_id={}):
     try:
         plaidItems = PlaidItem.objects.filter(user__id=uid)
-        balance_get_by_item = {}
-        for plaidItem in plaidItems:
-            if item_id and item_id != plaidItem.itemId:
-                continue
+        if item_id:
+            plaidItems = plaidItems.filter(itemId=item_id)
+
+        def balance_get(plaidItem):
             if plaidItem.itemId in account_ids_by_item_id:
                 exchange_request = AccountsBalanceGetRequest(
                     access_token=plaidItem.accessToken,
@@ -97,13 +104,19 @@ def plaid_balance_get(uid, item_id=None, account_ids_by_item_id={}):
                     )
                 )
         
+            acquire_plaid_budget()
             exchange_response = plaid_client.accounts_balance_get(exchange_request)
             serializer = BalanceGetResponseSerializer(
                 data=exchange_response.to_dict()
             )
             serializer.is_valid(raise_exception=True)
+            return serializer.validated_data
 
-            balance_get_by_item[plaidItem.itemId] = serializer.validated_data
+        balance_get_by_item = {}
+        for plaidItem, balances, error in map_plaid_items(balance_get, plaidItems):
+            if error:
+                raise error
+            balance_get_by_item[plaidItem.itemId] = balances
         return balance_get_by_item
     except ApiException as e:
         error = json.loads(e.body)
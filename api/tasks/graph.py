@@ -1,42 +1,140 @@
-from celery import shared_task, chord
+from celery import shared_task, chord, group
 from django.apps import apps
 from django.core.cache import cache 
 from django.utils import timezone
+from django.db import transaction, connection
+from django.dispatch import receiver
+from django.db.models.signals import post_save, post_delete
 
-from ..models import User, StockData, Investment, UserInvestmentGraph
+from ..models import User, StockPrice, Investment, UserInvestmentGraph, \
+    UserInvestmentGraphCheckpoint, TaskCheckpoint
 
-from django.db.models import OuterRef, Subquery
+from django.db.models import Q, Min
+from django.db.models.functions import Trunc
 
 from api.apis.yf import yf_client, FPMUtils
+from api.apis.fmp import get_historical_concurrently
 
 from datetime import datetime, timedelta
 from dateutil.relativedelta import relativedelta
 from django.utils.timezone import make_aware, get_default_timezone
 from zoneinfo import ZoneInfo
 import json
+import numpy as np
 
+from django.db.utils import OperationalError
 from buul_backend.retry_db import retry_on_db_error
+from buul_backend.viewHelper import bump_resource_version
+
+STOCK_DATA_SYMBOLS = ["VOO", "VOOG", "QQQ", "IBIT", "BTC", "BTCUSD"]
+GRAPH_EXTENSION_BATCH_SIZE = 250
+# first key of the advisory locks on users' graphs
+GRAPH_LOCK_NAMESPACE = 1
+
+# (resolution, age past which points are compacted to it)
+ROLLUP_TIERS = [
+    ("1h", relativedelta(days=1)),
+    ("1d", relativedelta(months=3)),
+    ("1w", relativedelta(years=1)),
+    ("1M", relativedelta(years=5)),
+]
+ROLLUP_TRUNC = {"h": "hour", "d": "day", "w": "week", "M": "month"}
+# span compacted per statement at each resolution, a whole number of its 
+# buckets, so each statement ranks a bounded number of rows
+ROLLUP_SLICES = {
+    "1h": relativedelta(days=1),
+    "1d": relativedelta(weeks=1),
+    "1w": relativedelta(weeks=4),
+    "1M": relativedelta(months=12),
+}
+# (Trunc kind, approximate seconds per bucket) of each graph resolution
+GRAPH_RESOLUTIONS = {
+    "1m": ("minute", 60),
+    "1h": ("hour", 3600),
+    "1d": ("day", 86400),
+    "1w": ("week", 604800),
+    "1M": ("month", 2629746),
+}
+# points fetched per point drawn when a resolution is picked for max_points
+GRAPH_OVERSAMPLING = 4
+# points returned when a request doesn't set max_points, so a fine resolution
+# over a long range is still downsampled
+GRAPH_DEFAULT_MAX_POINTS = 1000
 
 def fill_in_null_graph_values(symbols, start_date_rounded):
-    for symbol in symbols:
-        null_prices = StockData.objects.filter(**{
-            f"{symbol}__isnull": True,
-            "date__gte": start_date_rounded
-        }).order_by('date')
-        if null_prices.exists():
-            most_recent_prices = null_prices.annotate(
-                prev_price = Subquery((
-                    StockData.objects.filter(**{
-                        f"{symbol}__isnull": False,
-                        "date__lte": OuterRef("date")
-                    })
-                    .order_by("-date")
-                    .values(symbol)[:1]
-                ))
+    # last observation carried forward over the block since start_date_rounded,
+    # in one pass: a symbol missing at a date another symbol has a bar for 
+    # gets the symbol's latest earlier close. returns filled cells per symbol
+    dates, prices = StockPrice.objects \
+        .filter(date__gte=start_date_rounded) \
+        .price_matrix(symbols)
+    if not dates:
+        return {symbol: 0 for symbol in symbols}
+
+    # row 0 seeds each symbol with its last close before the block
+    seed = dict(
+        StockPrice.objects
+        .filter(symbol__in=symbols, date__lt=start_date_rounded)
+        .order_by("symbol", "-date")
+        .distinct("symbol")
+        .values_list("symbol", "close")
+    )
+    seeded = np.vstack([
+        [seed.get(symbol, np.nan) for symbol in symbols], 
+        prices
+    ])
+    observed = ~np.isnan(seeded)
+    last_observed = np.where(observed, np.arange(len(seeded))[:, None], 0)
+    np.maximum.accumulate(last_observed, axis=0, out=last_observed)
+    filled = seeded[last_observed, np.arange(len(symbols))][1:]
+
+    rows, columns = np.nonzero(~observed[1:] & ~np.isnan(filled))
+    upsert_stock_prices(
+        [
+            (symbols[column], dates[row], float(filled[row, column])) 
+            for row, column in zip(rows, columns)
+        ], 
+        interval=None
+    )
+    counts = np.bincount(columns, minlength=len(symbols))
+    return {symbol: int(counts[i]) for i, symbol in enumerate(symbols)}
+
+
+def merge_stock_bars(responses, start_date_rounded, interval):
+    # [(symbol, date, close)] across every symbol's response
+    bars = []
+    for symbol in responses:
+        for item in responses[symbol]:
+            item_date = FPMUtils.no_timezone_to_with_timezone(item["date"], interval)
+            if item_date < start_date_rounded:
+                continue
+            bars.append((symbol, item_date, item["close"]))
+    return bars
+
+def upsert_stock_prices(bars, interval, batch_size=1000):
+    # one multi-row INSERT per batch; bars already stored are left untouched
+    if not bars:
+        return {"inserted": 0, "skipped": 0}
+    StockPrice.ensure_partitions(
+        min(date for _, date, _ in bars), 
+        max(date for _, date, _ in bars)
+    )
+    table = connection.ops.quote_name(StockPrice._meta.db_table)
+    inserted = 0
+    with connection.cursor() as cursor:
+        for i in range(0, len(bars), batch_size):
+            batch = bars[i:i + batch_size]
+            params = []
+            for symbol, date, close in batch:
+                params.extend([symbol, interval, date, close])
+            cursor.execute(
+                f"INSERT INTO {table} (symbol, \"interval\", date, close) "
+                f"VALUES {', '.join(['(%s, %s, %s, %s)'] * len(batch))} "
+                "ON CONFLICT (symbol, date) DO NOTHING",
+                params
             )
-            for item in most_recent_prices:
-                item[symbol] = item.prev_price
-            StockData.objects.bulk_update(most_recent_prices, [symbol])
+            inserted += cursor.rowcount
+    return {"inserted": inserted, "skipped": len(bars) - inserted}
 
 
 @shared_task(name="refresh_stock_data_by_interval")
@@ -46,7 +144,8 @@ def refresh_stock_data_by_interval(symbols=["VOO", "VOOG", "QQQ", "IBIT", "BTC",
     cache.set("stock_data_refresh_complete", False)
 
     # get current date and most recent refresh date
-    most_recent_refresh_date_query = StockData.objects.all().order_by("-date")
+    most_recent_refresh_date_query = StockPrice.objects.filter(symbol__in=symbols) \
+        .order_by("-date")
     if not refresh_all and most_recent_refresh_date_query.exists():
         most_recent_refresh_date = most_recent_refresh_date_query.first().date
         most_recent_refresh_date_rounded = FPMUtils.round_date_down(
@@ -72,30 +171,18 @@ def refresh_stock_data_by_interval(symbols=["VOO", "VOOG", "QQQ", "IBIT", "BTC",
         cache.set("stock_data_refresh_complete", True)
         return 
 
-    # for each security...
-    for symbol in symbols:
-        # fetch data...
-        response = yf_client.get_historical(symbol, start_date_rounded, 
-                                            timezone.now(), interval)
-        # and save it to db
-        for item in response:
-            item_date = FPMUtils.no_timezone_to_with_timezone(item["date"], interval)
-            if item_date < start_date_rounded:
-                continue
-            item_price = item["close"]
-            stockData, created = StockData.objects.get_or_create(
-                date = item_date
-            )
-            if stockData[symbol]:
-                continue
-            else:
-                stockData[symbol] = item_price 
-                stockData.save()
+    # fetch every security concurrently, then merge their bars by timestamp
+    responses = get_historical_concurrently(
+        yf_client, symbols, start_date_rounded, timezone.now(), interval
+    )
+    bars = merge_stock_bars(responses, start_date_rounded, interval)
+    upsert_summary = upsert_stock_prices(bars, interval)
 
-    fill_in_null_graph_values(symbols, start_date_rounded)
+    upsert_summary["filled"] = fill_in_null_graph_values(symbols, start_date_rounded)
 
     cache.set("stock_data_refresh_complete", True)
-    return
+    fan_out_graph_extensions(symbols)
+    return upsert_summary
 
 @retry_on_db_error
 def refresh_stock_data_all():
@@ -104,96 +191,380 @@ def refresh_stock_data_all():
     delete_non_closing_times()
 
 
+def compact_window(model, partition_column, resolution, start_date, end_date):
+    # keep the latest point per (partition_column, resolution bucket) in 
+    # [start_date, end_date), ranking the window once
+    quote_name = connection.ops.quote_name
+    table = quote_name(model._meta.db_table)
+    key = ", ".join(quote_name(field.column) for field in model._meta.pk_fields)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"DELETE FROM {table} WHERE ({key}) IN ("
+            f"    SELECT {key} FROM ("
+            f"        SELECT {key}, row_number() OVER ("
+            f"            PARTITION BY {quote_name(partition_column)}, "
+            "            date_trunc(%s, date) ORDER BY date DESC"
+            "        ) AS rank "
+            f"        FROM {table} WHERE date >= %s AND date < %s"
+            "    ) ranked WHERE rank > 1"
+            ")",
+            [ROLLUP_TRUNC[resolution[1]], start_date, end_date]
+        )
+        return cursor.rowcount
+
+def compact_tier(resolution, current_date=None):
+    # compact only the window that aged into this tier since the last run, 
+    # one slice at a time, saving the watermark after each so an 
+    # interrupted run (or the first, which starts from the oldest point) 
+    # resumes where it stopped. window ends are aligned to the tier's 
+    # buckets so none is split
+    age = dict(ROLLUP_TIERS)[resolution]
+    current_date = current_date or timezone.now()
+    end_date = FPMUtils.round_date_down(current_date - age, granularity=resolution)
+
+    checkpoint, _ = TaskCheckpoint.objects.get_or_create(name="rollup")
+    deleted = {}
+    for model, partition_column in [(StockPrice, "symbol"), 
+                                    (UserInvestmentGraph, "user_id")]:
+        watermark = f"{model._meta.db_table}:{resolution}"
+        deleted[model.__name__] = 0
+        start_date = checkpoint.state.get(watermark)
+        if start_date is not None:
+            start_date = datetime.fromisoformat(start_date)
+        else:
+            oldest = model.objects.filter(date__lt=end_date) \
+                .aggregate(oldest=Min("date"))["oldest"]
+            start_date = FPMUtils.round_date_down(oldest, granularity=resolution) \
+                if oldest else end_date
+        while start_date < end_date:
+            slice_end = min(start_date + ROLLUP_SLICES[resolution], end_date)
+            deleted[model.__name__] += compact_window(
+                model, partition_column, resolution, start_date, slice_end
+            )
+            start_date = slice_end
+            checkpoint.state[watermark] = start_date.isoformat()
+            checkpoint.save(update_fields=["state", "updated_at"])
+        if watermark not in checkpoint.state:
+            # nothing old enough yet
+            checkpoint.state[watermark] = start_date.isoformat()
+            checkpoint.save(update_fields=["state", "updated_at"])
+    if deleted["UserInvestmentGraph"]:
+        bump_resource_version("graph")
+    return deleted
+
 @shared_task(name="delete_non_closing_times")
 @retry_on_db_error
 def delete_non_closing_times():
-    for interval in ["1m", "1h", "1d", "1w", "1M"]:
-        current_date_rounded = FPMUtils.round_date_down(
-            timezone.now(), 
-            granularity="1m"
+    current_date_rounded = FPMUtils.round_date_down(
+        timezone.now(), 
+        granularity="1m"
+    )
+    return {
+        resolution: compact_tier(resolution, current_date_rounded)
+        for resolution, _ in ROLLUP_TIERS
+    }
+
+
+def load_holdings(user, start_date, initial_holdings):
+    # change points of the user's holdings after start_date, in date order.
+    # row 0 is the holdings already in effect at start_date
+    investments = list(
+        Investment.objects.filter(user=user, date__gt=start_date).order_by("date") \
+            .values_list("date", "cumulative_quantities")
+    )
+    investments.insert(0, (None, initial_holdings))
+    symbols = list(STOCK_DATA_SYMBOLS)
+    for _, cumulative_quantities in investments:
+        for symbol in cumulative_quantities or {}:
+            if symbol not in symbols:
+                symbols.append(symbol)
+    column = {symbol: i for i, symbol in enumerate(symbols)}
+
+    timestamps = np.empty(len(investments), dtype=float)
+    quantities = np.zeros((len(investments), len(symbols)), dtype=float)
+    held = np.zeros((len(investments), len(symbols)), dtype=bool)
+    for row, (date, cumulative_quantities) in enumerate(investments):
+        timestamps[row] = date.timestamp() if date else -np.inf
+        for symbol, quantity in (cumulative_quantities or {}).items():
+            held[row, column[symbol]] = True
+            quantities[row, column[symbol]] = quantity or 0
+    return timestamps, symbols, quantities, held
+
+def load_price_matrix(symbols, start_date, end_date, include_start=True):
+    # symbols without any stored price have no prices (all NaN)
+    date_filter = {"date__gte" if include_start else "date__gt": start_date}
+    return StockPrice.objects \
+        .filter(date__lte=end_date, **date_filter) \
+        .price_matrix(symbols)
+
+def portfolio_values(price_timestamps, prices, holding_timestamps, quantities, held):
+    # as-of join: the latest holdings change at or before each price timestamp
+    as_of = np.searchsorted(holding_timestamps, price_timestamps, side="right") - 1
+    quantities = quantities[as_of]
+    held = held[as_of]
+
+    # a held symbol without a price makes the whole point unknown
+    missing_price = (held & np.isnan(prices)).any(axis=1)
+    values = np.where(held, prices * quantities, 0).sum(axis=1)
+    return values, ~missing_price, as_of
+
+def graph_start(user):
+    # without a checkpoint, resume from the last saved point or the beginning
+    last_saved_date_query = UserInvestmentGraph.objects.filter(user=user)\
+        .order_by('-date')
+    if last_saved_date_query.exists():
+        last_saved_date = last_saved_date_query.first()
+        return FPMUtils.round_date_down(
+            last_saved_date.date, 
+            granularity="1min"
         )
-        FPMUtils.delete_non_closing_times(current_date_rounded, interval)
 
+    # their first investment
+    first_investment_date_query = Investment.objects.filter(user=user)\
+        .order_by("date")
+    if first_investment_date_query.exists():
+        first_investment_date = first_investment_date_query.first().date
+    else:
+        first_investment_date = None
 
-@shared_task(name="get_graph_data")
-@retry_on_db_error
-def get_graph_data(uid):
-    try:
-        user = User.objects.get(id=uid)
+    # date five years ago
+    five_years_ago = FPMUtils.round_date_down(
+        timezone.now() - relativedelta(years=5), 
+        granularity="1min"
+    )
 
-        # the last time they requested graph data
-        last_saved_date_query = UserInvestmentGraph.objects.filter(user=user)\
-            .order_by('-date')
-        if last_saved_date_query.exists():
-            last_saved_date = last_saved_date_query.first()
-            start_date = FPMUtils.round_date_down(
-                last_saved_date.date, 
-                granularity="1min"
-            )
-        # if they've never requested graph data, start from beginning
+    # start_date = whichever is oldest
+    if first_investment_date is None:
+        return five_years_ago
+    return min(first_investment_date, five_years_ago)
+
+def holdings_as_of(user, date):
+    cumulative_quantities = Investment.objects \
+        .filter(user=user, date__lte=date) \
+        .order_by("-date") \
+        .values_list("cumulative_quantities", flat=True) \
+        .first()
+    return cumulative_quantities or {}
+
+def lock_graph(user_id):
+    # serializes extending a user's graph with invalidating it, until the 
+    # transaction ends. an advisory lock rather than a row lock: the 
+    # checkpoint may not exist yet, and locking the user row would hold up 
+    # every insert referencing the user for as long as a first build runs.
+    # users whose ids hash alike only wait on each other
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT pg_advisory_xact_lock(%s, hashtext(%s))",
+            [GRAPH_LOCK_NAMESPACE, str(user_id)]
+        )
+
+def extend_graph_data(user, end_date):
+    # the checkpoint and holdings are read and the points written under the 
+    # lock, so an investment saved meanwhile is either already loaded here 
+    # or invalidates these points once this commits
+    with transaction.atomic():
+        lock_graph(user.id)
+        written = extend_graph_data_locked(user, end_date)
+    if written:
+        bump_resource_version("graph", user.id)
+    return written
+
+def extend_graph_data_locked(user, end_date):
+    # only the points after the checkpoint are new; holdings carry over from it
+    checkpoint = UserInvestmentGraphCheckpoint.objects.select_for_update() \
+        .filter(user=user).first()
+    if checkpoint:
+        start_date = checkpoint.date
+        initial_holdings = checkpoint.holdings
+    else:
+        start_date = graph_start(user)
+        initial_holdings = holdings_as_of(user, start_date)
+
+    holding_timestamps, symbols, quantities, held = load_holdings(
+        user, start_date, initial_holdings
+    )
+    dates, prices = load_price_matrix(
+        symbols, start_date, end_date, include_start=checkpoint is None
+    )
+    if not dates:
+        return 0
+    price_timestamps = np.array([date.timestamp() for date in dates], dtype=float)
+    values, valid, as_of = portfolio_values(
+        price_timestamps, prices, holding_timestamps, quantities, held
+    )
+
+    UserInvestmentGraph.objects.bulk_create(
+        [
+            UserInvestmentGraph(user=user, date=dates[i], value=float(values[i]))
+            for i in np.flatnonzero(valid)
+        ],
+        batch_size=1000,
+        ignore_conflicts=True
+    )
+    last = as_of[-1]
+    UserInvestmentGraphCheckpoint.objects.update_or_create(
+        user=user,
+        defaults={
+            "date": dates[-1],
+            "holdings": {
+                symbol: float(quantities[last, i]) 
+                for i, symbol in enumerate(symbols) if held[last, i]
+            }
+        }
+    )
+    return int(valid.sum())
+
+def largest_triangle_three_buckets(timestamps, values, max_points):
+    # indices of max_points points (first and last always kept) which keep 
+    # the visual shape of the series: from each bucket, the point making 
+    # the largest triangle with the previous pick and the next bucket's mean
+    n = len(values)
+    if n <= max_points:
+        return np.arange(n)
+    edges = np.linspace(1, n - 1, max_points - 1).astype(np.intp)
+    selected = np.empty(max_points, dtype=np.intp)
+    selected[0], selected[-1] = 0, n - 1
+    previous = 0
+    for i in range(max_points - 2):
+        start, end = edges[i], edges[i + 1]
+        if i == max_points - 3:
+            next_t, next_v = timestamps[-1], values[-1]
         else:
-            # their first investment
-            first_investment_date_query = Investment.objects.filter(user=user)\
-                .order_by("date")
-            if first_investment_date_query.exists():
-                first_investment_date = first_investment_date_query.first().date
-            else:
-                first_investment_date = None
+            next_t = timestamps[end:edges[i + 2]].mean()
+            next_v = values[end:edges[i + 2]].mean()
+        areas = np.abs(
+            (timestamps[previous] - next_t) * (values[start:end] - values[previous])
+            - (timestamps[previous] - timestamps[start:end]) * (next_v - values[previous])
+        )
+        previous = start + int(np.argmax(areas))
+        selected[i + 1] = previous
+    return selected
 
-            # date five years ago
-            five_years_ago = FPMUtils.round_date_down(
-                timezone.now() - relativedelta(years=5), 
-                granularity="1min"
-            )
+def graph_series(uid, start_date, resolution=None, max_points=None):
+    # columnar {"t": [epoch seconds], "v": [values]} of the user's graph, at 
+    # most one point (the latest) per resolution bucket and at most 
+    # max_points points, GRAPH_DEFAULT_MAX_POINTS if not given
+    if max_points is None:
+        max_points = GRAPH_DEFAULT_MAX_POINTS
+    if resolution is None:
+        # finest resolution that doesn't fetch far more points than drawn
+        span = (timezone.now() - start_date).total_seconds()
+        resolution = next(
+            (
+                resolution for resolution, (_, seconds) in GRAPH_RESOLUTIONS.items()
+                if span / seconds <= max_points * GRAPH_OVERSAMPLING
+            ),
+            "1M"
+        )
 
-            # start_date = whichever is oldest
-            if first_investment_date is None:
-                start_date = five_years_ago
+    query = UserInvestmentGraph.objects.filter(user__id=uid, date__gte=start_date)
+    if resolution is not None:
+        query = query \
+            .annotate(bucket=Trunc("date", GRAPH_RESOLUTIONS[resolution][0], 
+                                   tzinfo=ZoneInfo("UTC"))) \
+            .order_by("bucket", "-date") \
+            .distinct("bucket")
+    else:
+        query = query.order_by("date")
+    rows = query.values_list("date", "value")
+
+    timestamps = np.array([date.timestamp() for date, _ in rows], dtype=float)
+    values = np.array([value for _, value in rows], dtype=float)
+    selected = largest_triangle_three_buckets(timestamps, values, max_points)
+    timestamps, values = timestamps[selected], values[selected]
+    return {"t": timestamps.astype(np.int64).tolist(), "v": values.tolist()}
+
+@receiver(post_save, sender=Investment)
+@receiver(post_delete, sender=Investment)
+@retry_on_db_error
+def invalidate_graph_data(sender, instance, **kwargs):
+    # an investment in the past changes every point from its date onwards.
+    # waits for an extend in progress, then rewinds what it wrote
+    with transaction.atomic():
+        lock_graph(instance.user_id)
+        UserInvestmentGraph.objects.filter(
+            user_id=instance.user_id, 
+            date__gte=instance.date
+        ).delete()
+
+        checkpoint = UserInvestmentGraphCheckpoint.objects.select_for_update() \
+            .filter(user_id=instance.user_id, date__gte=instance.date) \
+            .first()
+        if checkpoint:
+            last_point = UserInvestmentGraph.objects \
+                .filter(user_id=instance.user_id) \
+                .order_by("-date") \
+                .first()
+            if last_point is None:
+                checkpoint.delete()
             else:
-                start_date = min(first_investment_date, five_years_ago)
-        
-        cumulative_quantity_subquery = (
-            Investment.objects.filter(
-                user=user,
-                date__lte=OuterRef("date")
-            )
-            .order_by("-date")
-            .values("cumulative_quantities")[:1]
+                checkpoint.date = last_point.date
+                checkpoint.holdings = holdings_as_of(instance.user_id, last_point.date)
+                checkpoint.save()
+    bump_resource_version("graph", instance.user_id)
+
+@retry_on_db_error
+def fan_out_graph_extensions(symbols, batch_size=GRAPH_EXTENSION_BATCH_SIZE):
+    # extend the graphs of everyone holding a refreshed symbol, so chart reads
+    # find the new points already materialized
+    uids = list(
+        Investment.objects
+        .filter(Q(symbol__in=symbols) | Q(cumulative_quantities__has_any_keys=symbols))
+        .values_list("user_id", flat=True)
+        .distinct()
+    )
+    if not uids:
+        return 0
+    batches = [
+        [str(uid) for uid in uids[i:i + batch_size]] 
+        for i in range(0, len(uids), batch_size)
+    ]
+    group(extend_graph_data_batch.s(batch) for batch in batches).apply_async()
+    return len(batches)
+
+@shared_task(name="extend_graph_data_batch")
+@retry_on_db_error
+def extend_graph_data_batch(uids):
+    # a newer refresh is mid-write; its own fan-out will pick these users up
+    if not cache.get("stock_data_refresh_complete"):
+        return {"extended": 0, "points": 0, "errors": {}}
+
+    end_date = FPMUtils.round_date_down(
+        timezone.now(), 
+        granularity="1min"
+    )
+    extended, points, errors = 0, 0, {}
+    for user in User.objects.filter(id__in=uids):
+        try:
+            points += extend_graph_data(user, end_date)
+            extended += 1
+        except Exception as e:
+            if isinstance(e, OperationalError):
+                raise e
+            errors[str(user.id)] = str(e)
+            continue
+        cache.delete(f"uid_{user.id}_get_investment_graph_data")
+        cache.set(
+            f"uid_{user.id}_get_investment_graph_data",
+            json.dumps({"success": "calculated and saved", "error": None}),
+            timeout=120
         )
+    return {"extended": extended, "points": points, "errors": errors}
 
+@shared_task(name="get_graph_data")
+@retry_on_db_error
+def get_graph_data(uid):
+    try:
         # if mid-refresh, fetch stale data to let refresh complete. mb unnecessary
         if not cache.get("stock_data_refresh_complete"):
             return
-        else:
-            end_date = FPMUtils.round_date_down(
-                timezone.now(), 
-                granularity="1min"
-            )
 
-        # Annotate Investment with the JSON-aggregated cumulative quantities
-        queryset = StockData.objects \
-            .filter(date__gte=start_date, date__lte=end_date) \
-            .annotate(
-                cumulative_quantities=Subquery(cumulative_quantity_subquery)
-            )
-        
-        for stockData in queryset:
-            quantities = stockData.cumulative_quantities or {}
-            price = 0
-            null_stock_price = False
-            for symbol in quantities:
-                if stockData[symbol] is None:
-                    null_stock_price = True
-                    break
-                price += stockData[symbol] * (quantities[symbol] or 0)
-            if not null_stock_price:
-                userInvestmentGraph, created = UserInvestmentGraph.objects.get_or_create(
-                    user = user,
-                    date = stockData.date,
-                    defaults = {'value': price}
-                )
-            if created:
-                userInvestmentGraph.save()
+        user = User.objects.get(id=uid)
+        end_date = FPMUtils.round_date_down(
+            timezone.now(), 
+            granularity="1min"
+        )
+        extend_graph_data(user, end_date)
         
         cache.delete(f"uid_{uid}_get_investment_graph_data")
         cache.set(
@@ -208,4 +579,3 @@ def get_graph_data(uid):
             json.dumps({"success": None, "error": f"error {str(e)}"}),
             timeout=120
         )
-            
\ No newline at end of file
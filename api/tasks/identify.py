@@ -1,29 +1,47 @@
-from celery import shared_task
+from celery import shared_task, group
+from django.core.cache import cache
 from django.utils import timezone
 from django.apps import apps
 
-from api.apis.plaid import plaid_client
-from ..jsonUtils import filter_jsons
+from api.apis.plaid import plaid_client, map_plaid_items, \
+    acquire_plaid_budget, cache_lock
+from ..jsonUtils import filter_jsons, get_nested
+from .. import classifier
+from ..spending import PLAID_CATEGORY_DETAIL_TO_BUUL_CATEGORIES, \
+    transaction_category, transactions_of, spending_by
 
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
 from dateutil.relativedelta import relativedelta
 from django.utils import timezone
 from zoneinfo import ZoneInfo
 import json
-import re
+import time
 
+from django.db import transaction
+from django.db.models import Q, Sum, Count, Min, Max
 from django.db.utils import OperationalError
 from plaid.model.transactions_get_request import TransactionsGetRequest
 from plaid.model.transactions_get_request_options import TransactionsGetRequestOptions
 from plaid.model.transactions_sync_request import TransactionsSyncRequest
 from plaid.exceptions import ApiException
+from redis.exceptions import LockError
 
 from..serializers.plaid.transaction import TransactionsSyncResponseSerializer, \
     TransactionsGetResponseSerializer
 from ..models import PlaidItem, User, PlaidCashbackTransaction, \
-    PlaidPersonalFinanceCategories
+    PlaidPersonalFinanceCategories, Deposit, TaskCheckpoint, \
+    PlaidCategorizedTransaction, PlaidCategorySpending
 
 from buul_backend.retry_db import retry_on_db_error
+
+# seconds a webhook burst has to settle before its sync starts, and how long
+# a sync's item lock lasts without the sync reaching its next page
+TRANSACTIONS_UPDATE_DEBOUNCE = 5
+TRANSACTIONS_UPDATE_LOCK_TIMEOUT = 15 * 60
+
+# users per shard of the weekly spending by category job
+SPENDING_BY_CATEGORY_SHARD_SIZE = 200
+
 # plaid transactions 
 
 
@@ -32,12 +50,38 @@ from buul_backend.retry_db import retry_on_db_error
 
 # find cashback 
 
+def transactions_sync_pages(plaidItem, page_size=100):
+    # validated sync pages from the item's stored cursor, one at a time, so 
+    # a sync never holds more than a page. each page carries the cursor to 
+    # store once it has been processed
+    hasMore = True
+    nextCursor = plaidItem.transactionsCursor
+    while hasMore:
+        if nextCursor is not None: 
+            # test if we can get rid of second case
+            exchange_request = TransactionsSyncRequest(
+                plaidItem.accessToken,
+                cursor = nextCursor,
+                count=page_size
+            )
+        else:
+            exchange_request = TransactionsSyncRequest(
+                plaidItem.accessToken,
+                count=page_size
+            )
+        acquire_plaid_budget()
+        exchange_response = plaid_client.transactions_sync(exchange_request)
+        serializer = TransactionsSyncResponseSerializer(
+            data=exchange_response.to_dict()
+        )
+        serializer.is_valid(raise_exception=True)
+        nextCursor = serializer.validated_data["next_cursor"]
+        hasMore = serializer.validated_data["has_more"]
+        yield serializer.validated_data
+
 @shared_task(name="transactions_sync")
 @retry_on_db_error
 def transactions_sync(uid=None, item_ids={}, update_cursor=False, page_size=100):
-    # import pdb
-    # breakpoint()
-
     if item_ids:
         plaidItems = PlaidItem.objects.filter(itemId__in=item_ids)
     elif uid:
@@ -47,44 +91,39 @@ def transactions_sync(uid=None, item_ids={}, update_cursor=False, page_size=100)
         
     try:
         # eventually both prevent duplicate items, and filter out duplicate accounts here
-        transactions_sync_by_item = {}
-        for plaidItem in plaidItems:
-            hasMore = True
-            page = 0
-            nextCursor = plaidItem.transactionsCursor
+        def sync(plaidItem):
             added, modified, removed = [], [], []
-            while hasMore:
-                if nextCursor is not None: 
-                    # test if we can get rid of second case
-                    exchange_request = TransactionsSyncRequest(
-                        plaidItem.accessToken,
-                        cursor = nextCursor,
-                        count=page_size
-                    )
-                else:
-                    exchange_request = TransactionsSyncRequest(
-                        plaidItem.accessToken,
-                        count=page_size
-                    )
-                exchange_response = plaid_client.transactions_sync(exchange_request)
-                serializer = TransactionsSyncResponseSerializer(
-                    data=exchange_response.to_dict()
-                )
-                serializer.is_valid(raise_exception=True)
-
-                added.extend(serializer.validated_data['added'])
-                modified.extend(serializer.validated_data['modified'])
-                removed.extend(serializer.validated_data['removed'])
-                nextCursor = serializer.validated_data["next_cursor"]
-                hasMore = serializer.validated_data["has_more"]
-                page += 1
-                if update_cursor:
-                    plaidItem.transactionsCursor = nextCursor
-                    plaidItem.save()
+            # moving the cursor takes the item's lock, like update_transactions
+            lock = item_transactions_lock(plaidItem.itemId) if update_cursor else None
+            if lock is not None and not lock.acquire():
+                raise Exception(f"item {plaidItem.itemId} is already syncing")
+            try:
+                for page in transactions_sync_pages(plaidItem, page_size=page_size):
+                    added.extend(page['added'])
+                    modified.extend(page['modified'])
+                    removed.extend(page['removed'])
+                    if lock is not None:
+                        lock.extend(TRANSACTIONS_UPDATE_LOCK_TIMEOUT, replace_ttl=True)
+                        with transaction.atomic():
+                            update_category_spending(plaidItem, page)
+                            PlaidItem.objects.filter(pk=plaidItem.pk) \
+                                .update(transactionsCursor=page["next_cursor"])
+            finally:
+                if lock is not None:
+                    release_item_transactions_lock(plaidItem.itemId, lock)
+            return added, modified, removed
+
+        added, modified, removed = [], [], []
+        for plaidItem, synced, error in map_plaid_items(sync, plaidItems):
+            if error:
+                raise error
+            added.extend(synced[0])
+            modified.extend(synced[1])
+            removed.extend(synced[2])
         return added, modified, removed
     except ApiException as e:
         error = json.loads(e.body)
-        return f"transactions sync get error: {error.get("error_code")}"
+        return f"transactions sync get error: {error.get('error_code')}"
     except Exception as e:
         if isinstance(e, OperationalError):
             raise e
@@ -92,280 +131,350 @@ def transactions_sync(uid=None, item_ids={}, update_cursor=False, page_size=100)
 
 @retry_on_db_error
 def is_cashback(name):
-    keywords_include = [
-        "CASHBACK",
-        "CASH BACK",
-        "CASH AWARD",
-        "CASH REWARD",
-        "CASHREWARD", 
-        "CASH REDEMPTION",
-        "CASH AUTO REDEMPTION", # real name
-        "CASHBACK BONUS",
-        "CASHBACK REDEMPTION",
-        "CASHBACK REWARDS",
-        "REWARDS DEPOSIT",
-        "REWARDS CREDIT",
-        "REWARDS DEPOSIT",
-        "REWARDS REDEMPTION",
-        "STATEMENT CREDIT",
-        "CREDIT- REWARD", # real name
-        "CREDIT REWARD",
-        "WELLS FARGO REWARDS",
-        "CREDIT CRD DES:RWRD"
-    ]
-    keywords_reject = [
-        "ZELLE",
-        "BILL",
-        "CITY",
-        "DIRECT DEP"
-    ]
-    # add in terms to return false for. 
-    # use 'word boundaries' around CASH etc so it won't match "CASHIER" etc
-    match_pattern = '|'.join(map(re.escape, keywords_include))
-    is_match = re.search(match_pattern, name) is not None
-    reject_pattern = '|'.join(map(re.escape, keywords_reject))
-    is_reject = re.search(reject_pattern, name) is not None 
-    return is_match and not is_reject
-
+    return classifier.is_cashback(name)
+
+def is_cashback_filter(transactions):
+    # classify every name in one batch, so filter_jsons only looks them up
+    names = [get_nested(transaction, "name") for transaction in transactions]
+    cashback_names = {
+        name for name, cashback in zip(names, classifier.classify_batch(names)) 
+        if cashback
+    }
+    return {
+        "func": lambda name, bool: (name in cashback_names) == bool,
+        "filter_set": {"name" : [True]}
+    }
 
-@shared_task(name="find_cashback_added")
-@retry_on_db_error
-def find_cashback_added(uid, transactions, eq={}, gt={}, lt={}, lte={}, gte={}, 
-                        metric_to_return_by=None):
-    user = User.objects.get(id=uid)
 
+def cashback_candidates_of(transactions, eq={}, gt={}, lt={}, lte={}, gte={}, 
+                           metric_to_return_by=None):
     lt = {"amount": [0]}
-    is_cashback_name = {
-        "func": lambda name, bool: is_cashback(name) == bool,
-        "filter_set": {"name" : [True]}
-    }
+    is_cashback_name = is_cashback_filter(transactions)
     cashback_candidates = filter_jsons(transactions, eq=eq, gt=gt, lt=lt, lte=lte, 
                         gte=gte, metric_to_return_by=metric_to_return_by, 
                         is_cashback=is_cashback_name)
-    if isinstance(cashback_candidates, str):
-        raise Exception(cashback_candidates)
-    all_cashback = []
+    if isinstance(cashback_candidates, dict) and "error" in cashback_candidates:
+        raise Exception(cashback_candidates["error"])
+    return cashback_candidates
+
+def upsert_cashback(uid, cashback_candidates):
+    # one query for the rows already stored, one upsert per 100 candidates 
+    # and one UPDATE for the deposits to flag, however many candidates.
+    # a row can only be upserted once per statement, so the last version wins
+    cashback_candidates = list({
+        cashback["transaction_id"]: cashback for cashback in cashback_candidates
+    }.values())
+    user = User.objects.get(id=uid)
+    existing = {
+        cashback.transaction_id: cashback 
+        for cashback in PlaidCashbackTransaction.objects.filter(
+            user=user,
+            transaction_id__in=[cashback["transaction_id"] for cashback in cashback_candidates]
+        )
+    }
+
+    # a deposit already made for a cashback keeps the amount it was made 
+    # for; if plaid changes that amount, the deposit is flagged instead
+    with_deposit, without_deposit = [], []
+    deposits_to_flag = set()
     for cashback in cashback_candidates:
+        current = existing.get(cashback["transaction_id"])
+        has_deposit = current is not None and current.deposit_id is not None
+        if has_deposit and (cashback["amount"] != current.amount or \
+                cashback["iso_currency_code"] != current.iso_currency_code):
+            deposits_to_flag.add(current.deposit_id)
         plaidCashbackTransaction = PlaidCashbackTransaction(
             user = user,
             transaction_id = cashback["transaction_id"],
             account_id = cashback["account_id"],
-            amount = cashback["amount"],
+            amount = current.amount if has_deposit else cashback["amount"],
             pending = cashback["pending"],
             authorized_date = cashback["authorized_date"],
             authorized_datetime = cashback["authorized_datetime"], 
             date = cashback["date"],
             name = cashback["name"],
-            iso_currency_code = cashback["iso_currency_code"],
+            iso_currency_code = current.iso_currency_code if has_deposit \
+                else cashback["iso_currency_code"],
             flag = user.date_joined > timezone.make_aware(
                 datetime.combine(cashback["date"], datetime.min.time()),
                 timezone.get_current_timezone()
             )
         )
-        all_cashback.append(plaidCashbackTransaction)
-    try:
-        PlaidCashbackTransaction.objects.bulk_create(all_cashback, batch_size=100)
-        return {
-            "added": len(all_cashback), 
-            "modified": 0,
-            "deleted": 0,
-            "deposits_flagged": 0
-        }
-    except:
-        # if bulk create fails
-        cashback_added = 0
-        cashback_modified = 0
-        deposits_flagged = 0
-        for cashback in cashback_candidates:
-            # could use all_cashback instead
-            try:
-                # try to create them individually 
-                plaidCashbackTransaction = PlaidCashbackTransaction(
-                    user = User.objects.get(id=uid),
-                    transaction_id = cashback["transaction_id"],
-                    account_id = cashback["account_id"],
-                    amount = cashback["amount"],
-                    pending = cashback["pending"],
-                    authorized_date = cashback["authorized_date"],
-                    authorized_datetime = cashback["authorized_datetime"], 
-                    date = cashback["date"],
-                    name = cashback["name"],
-                    iso_currency_code = cashback["iso_currency_code"],
-                    flag = user.date_joined > timezone.make_aware(
-                        datetime.combine(cashback["date"], datetime.min.time()),
-                        timezone.get_current_timezone()
-                    )
-                )
-                plaidCashbackTransaction.save()
-                cashback_added += 1
-            except:
-                # if fails then assume it's because it already exists 
-                plaidCashbackTransaction = PlaidCashbackTransaction.objects.get(
-                    user = User.objects.get(id=uid),
-                    transaction_id = cashback["transaction_id"],
-                    account_id = cashback["account_id"]
-                )
-                if plaidCashbackTransaction.deposit is not None and \
-                cashback["amount"] != plaidCashbackTransaction.amount or \
-                cashback["iso_currency_code"] != plaidCashbackTransaction.iso_currency_code:
-                    plaidCashbackTransaction.deposit.flag = True
-                    deposits_flagged += 1
-                if not plaidCashbackTransaction.deposit:
-                    plaidCashbackTransaction.amount = cashback["amount"]
-                    plaidCashbackTransaction.iso_currency_code = cashback["iso_currency_code"]
-                plaidCashbackTransaction.pending = cashback["pending"]
-                plaidCashbackTransaction.authorized_date = cashback["authorized_date"]
-                plaidCashbackTransaction.authorized_datetime = cashback["authorized_datetime"]
-                plaidCashbackTransaction.date = cashback["date"]
-                plaidCashbackTransaction.name = cashback["name"]
-                plaidCashbackTransaction.iso_currency_code = cashback["iso_currency_code"]
-                plaidCashbackTransaction.save()
-                cashback_modified += 1
-
-                # xact x deposit, deposit connected to investment
-                # something to mark any deposits or investments 
-        return {
-            "added": cashback_added, 
-            "modified": cashback_modified,
-            "deleted": 0,
-            "deposits_flagged": deposits_flagged
-        }
+        (with_deposit if has_deposit else without_deposit).append(plaidCashbackTransaction)
+
+    update_fields = ["pending", "authorized_date", "authorized_datetime", "date", "name"]
+    for plaidCashbackTransactions, fields in [
+        (with_deposit, update_fields), 
+        (without_deposit, update_fields + ["amount", "iso_currency_code"])
+    ]:
+        PlaidCashbackTransaction.objects.bulk_create(
+            plaidCashbackTransactions, 
+            batch_size=100,
+            update_conflicts=True,
+            unique_fields=["user", "transaction_id"],
+            update_fields=fields
+        )
+    Deposit.objects.filter(id__in=deposits_to_flag).update(flag=True)
 
-@shared_task(name="find_cashback_modified")
-@retry_on_db_error
-def find_cashback_modified(uid, transactions, eq={}, gt={}, lt={}, lte={}, gte={}, 
-                        metric_to_return_by=None):
-    lt = {"amount": [0]}
-    is_cashback_name = {
-        "func": lambda name, bool: is_cashback(name) == bool,
-        "filter_set": {"name" : [True]}
+    modified = sum(cashback["transaction_id"] in existing for cashback in cashback_candidates)
+    return {
+        "added": len(cashback_candidates) - modified, 
+        "modified": modified,
+        "deleted": 0,
+        "deposits_flagged": len(deposits_to_flag)
     }
-    cashback_candidates = filter_jsons(transactions, eq=eq, gt=gt, lt=lt, lte=lte, 
-                        gte=gte, metric_to_return_by=metric_to_return_by, 
-                        is_cashback=is_cashback_name)
-    to_create = []
-    to_update = []
-    deposits_flagged = 0
-    for cashback in cashback_candidates:
-        try:
-            plaidCashbackTransaction = PlaidCashbackTransaction.objects.get(
-                user = User.objects.get(id=uid),
-                transaction_id = cashback["transaction_id"],
-                account_id = cashback["account_id"]
-            )
-            if plaidCashbackTransaction.deposit is not None and \
-                cashback["amount"] != plaidCashbackTransaction.amount or \
-                cashback["iso_currency_code"] != plaidCashbackTransaction.iso_currency_code:
-                plaidCashbackTransaction.deposit.flag = True
-                deposits_flagged += 1
-            if not plaidCashbackTransaction.deposit:
-                plaidCashbackTransaction.amount = cashback["amount"]
-                plaidCashbackTransaction.iso_currency_code = cashback["iso_currency_code"]
-            plaidCashbackTransaction.pending = cashback["pending"]
-            plaidCashbackTransaction.authorized_date = cashback["authorized_date"]
-            plaidCashbackTransaction.authorized_datetime = cashback["authorized_datetime"]
-            plaidCashbackTransaction.date = cashback["date"]
-            to_create.append(plaidCashbackTransaction)
-
-            # xact x deposit, deposit connected to investment
-            # something to mark any deposits or investments 
-        except:
-            plaidCashbackTransaction = PlaidCashbackTransaction(
-                user = User.objects.get(id=uid),
-                transaction_id = cashback["transaction_id"],
-                account_id = cashback["account_id"],
-                amount = cashback["amount"],
-                pending = cashback["pending"],
-                date = cashback["date"],
-                authorized_date = cashback["authorized_date"],
-                authorized_datetime = cashback["datetime"], 
-                name = cashback["name"],
-                iso_currency_code = cashback["iso_currency_code"]
-            )
-            to_update.append(plaidCashbackTransaction)
-    PlaidCashbackTransaction.objects.bulk_create(to_create, batch_size=100)
-    PlaidCashbackTransaction.objects.bulk_update(
-        to_update, 
-        ["amount", "iso_currency_code", "pending", "authorized_date", 
-         "authorized_datetime", "date"],
-         batch_size=100
+
+def remove_cashback(uid, cashback_candidates):
+    # cashback already deposited stays, with its deposit flagged
+    removed = PlaidCashbackTransaction.objects.filter(
+        user__id=uid,
+        transaction_id__in=[cashback["transaction_id"] for cashback in cashback_candidates]
     )
+    deposits_flagged = Deposit.objects \
+        .filter(id__in=removed.filter(deposit__isnull=False).values("deposit_id")) \
+        .update(flag=True)
+    cashback_deleted, _ = removed.filter(deposit__isnull=True).delete()
     return {
-        "added": len(to_create), 
-        "modified": len(to_update),
-        "deleted": 0,
+        "added": 0, 
+        "modified": 0,
+        "deleted": cashback_deleted,
         "deposits_flagged": deposits_flagged
     }
 
-# in future turn these into generators?
-# or in future make transactions ordered by dictionary (key=cashback?)
+@shared_task(name="find_cashback_added")
+@retry_on_db_error
+def find_cashback_added(uid, transactions, eq={}, gt={}, lt={}, lte={}, gte={}, 
+                        metric_to_return_by=None):
+    cashback_candidates = cashback_candidates_of(
+        transactions, eq=eq, gt=gt, lt=lt, lte=lte, gte=gte, 
+        metric_to_return_by=metric_to_return_by
+    )
+    return upsert_cashback(uid, cashback_candidates)
+
+@shared_task(name="find_cashback_modified")
+@retry_on_db_error
+def find_cashback_modified(uid, transactions, eq={}, gt={}, lt={}, lte={}, gte={}, 
+                        metric_to_return_by=None):
+    cashback_candidates = cashback_candidates_of(
+        transactions, eq=eq, gt=gt, lt=lt, lte=lte, gte=gte, 
+        metric_to_return_by=metric_to_return_by
+    )
+    return upsert_cashback(uid, cashback_candidates)
+
 @shared_task(name="find_cashback_removed")
 @retry_on_db_error
 def find_cashback_removed(uid, transactions, eq={}, gt={}, lt={}, lte={}, gte={}, 
                         metric_to_return_by=None):
-    lt = {"amount": [0]}
-    is_cashback_name = {
-        "func": lambda name, bool: is_cashback(name) == bool,
-        "filter_set": {"name" : [True]}
-    }
-    cashback_candidates = filter_jsons(transactions, eq=eq, gt=gt, lt=lt, lte=lte, 
-                        gte=gte, metric_to_return_by=metric_to_return_by, 
-                        is_cashback=is_cashback_name)
-    cashback_deleted = 0
-    deposits_flagged = 0
-    for cashback in cashback_candidates:
-        try:
-            plaidCashbackTransaction = PlaidCashbackTransaction.objects.get(
-                user = User.objects.get(id=uid),
-                transaction_id = cashback["transaction_id"],
-                account_id = cashback["account_id"]
+    cashback_candidates = cashback_candidates_of(
+        transactions, eq=eq, gt=gt, lt=lt, lte=lte, gte=gte, 
+        metric_to_return_by=metric_to_return_by
+    )
+    return remove_cashback(uid, cashback_candidates)
+
+def request_transactions_update(item_id):
+    # webhook bursts for an item coalesce into one scheduled sync. the flag 
+    # clears when that sync starts. while a sync runs, it's left for that 
+    # sync to schedule the one follow-up when it finishes
+    if cache.add(f"item_{item_id}_transactions_dirty", True, 
+                 timeout=TRANSACTIONS_UPDATE_LOCK_TIMEOUT):
+        if not cache.has_key(f"item_{item_id}_transactions_lock"):
+            update_transactions.apply_async(
+                args = [item_id], 
+                countdown = TRANSACTIONS_UPDATE_DEBOUNCE
             )
-            if plaidCashbackTransaction.deposit is None:
-                plaidCashbackTransaction.delete()
-                cashback_deleted += 1
-            else: 
-                plaidCashbackTransaction.deposit.flag = True
-                plaidCashbackTransaction.deposit.save()
-                deposits_flagged += 1
-        except:
-            continue
-    return {
-        "added": 0, 
-        "modified": 0,
-        "deleted": cashback_deleted,
-        "deposits_flagged": deposits_flagged
-    }
+        return True
+    return False
+
+def item_transactions_lock(item_id):
+    # held by whatever writes an item's cursor or category spending ledger
+    return cache_lock(
+        f"item_{item_id}_transactions_lock", TRANSACTIONS_UPDATE_LOCK_TIMEOUT
+    )
+
+def release_item_transactions_lock(item_id, lock):
+    try:
+        lock.release()
+    except LockError:
+        pass # expired, and maybe taken by another sync since
+    # updates that arrived while it was held, which the holder's cursor may
+    # not cover
+    if cache.get(f"item_{item_id}_transactions_dirty"):
+        update_transactions.apply_async(
+            args = [item_id], 
+            countdown = TRANSACTIONS_UPDATE_DEBOUNCE
+        )
 
 @shared_task(name="update_transactions")
 @retry_on_db_error
 def update_transactions(item_id):
+    # one sync per item at a time, so runs never race on the cursor
+    lock = item_transactions_lock(item_id)
+    if not lock.acquire():
+        # the running sync picks up the dirty flag when it's done
+        return {"error": None, "success": "sync already running"}
+    try:
+        cache.delete(f"item_{item_id}_transactions_dirty")
+        return sync_item_transactions(item_id, lock=lock)
+    finally:
+        release_item_transactions_lock(item_id, lock)
+
+@retry_on_db_error
+def sync_item_transactions(item_id, lock=None):
     item = PlaidItem.objects.get(itemId = item_id)
     uid = item.user.id
     start_cursor = item.transactionsCursor
+    update_summary = {"added": 0, "modified": 0, "deleted": 0, "deposits_flagged": 0}
     try:
-        added, modified, removed = transactions_sync(
-            item_ids={item_id}, update_cursor=True
-        )
-        added_summary = find_cashback_added(uid, added)
-        modified_summary = find_cashback_modified(uid, modified)
-        removed_summary = find_cashback_removed(uid, removed)
-
-        update_summary = {"added": 0, "modified": 0, "deleted": 0, "deposits_flagged": 0}
-        modified
-        for key in update_summary:
-            update_summary[key] = added_summary[key] + modified_summary[key] + removed_summary[key]
+        # each page's cashback changes commit together with the cursor past 
+        # it, so a failed sync resumes from the last page processed
+        for page in transactions_sync_pages(item):
+            if lock is not None:
+                # raises if the lock expired, rather than racing its new owner
+                lock.extend(TRANSACTIONS_UPDATE_LOCK_TIMEOUT, replace_ttl=True)
+            with transaction.atomic():
+                added_summary = find_cashback_added(uid, page["added"])
+                modified_summary = find_cashback_modified(uid, page["modified"])
+                removed_summary = find_cashback_removed(uid, page["removed"])
+                update_category_spending(item, page)
+                PlaidItem.objects.filter(pk=item.pk) \
+                    .update(transactionsCursor=page["next_cursor"])
+            for key in update_summary:
+                update_summary[key] += added_summary[key] + modified_summary[key] \
+                    + removed_summary[key]
+        # a sync from no cursor has brought in the item's whole history
+        if start_cursor is None:
+            PlaidItem.objects.filter(pk=item.pk, categorySpendingSince=None) \
+                .update(categorySpendingSince=date.min)
         return update_summary
+    except ApiException as e:
+        error = json.loads(e.body)
+        # plaid wants pagination restarted from its first cursor. replaying 
+        # the pages already processed is harmless
+        if error.get("error_code") == "TRANSACTIONS_SYNC_MUTATION_DURING_PAGINATION":
+            PlaidItem.objects.filter(pk=item.pk) \
+                .update(transactionsCursor=start_cursor)
+        return {"error": f"transactions sync get error: {error.get('error_code')}"}
     except Exception as e:
         if isinstance(e, OperationalError):
             raise e
-        item.transactionsCursor = start_cursor
-        item.save()
         return {"error": str(e)}
         # some sort of CTE / view made from celery logs
 
 
 # spending by category
 
+def update_category_spending(plaidItem, page):
+    # apply a page of added, modified and removed transactions to the 
+    # item's ledger, then re-sum the days it touched. runs in the caller's
+    # transaction, and callers hold the item's transactions lock, so two 
+    # ledger updates of an item never interleave
+    changed = page.get("added", []) + page.get("modified", [])
+    transaction_ids = [t["transaction_id"] for t in page.get("removed", [])] \
+        + [t["transaction_id"] for t in changed]
+    if not transaction_ids:
+        return 0
+    ledger = PlaidCategorizedTransaction.objects.filter(item=plaidItem)
+    previous = ledger.filter(transaction_id__in=transaction_ids)
+    touched = set(previous.values_list("category", "date"))
+
+    rows = {}
+    for t in changed:
+        category = transaction_category(t)
+        if category is None:
+            continue
+        rows[t["transaction_id"]] = PlaidCategorizedTransaction(
+            item=plaidItem,
+            transaction_id=t["transaction_id"],
+            category=category,
+            date=t["date"],
+            amount=t["amount"]
+        )
+        touched.add((category, t["date"]))
+    previous.delete()
+    PlaidCategorizedTransaction.objects.bulk_create(
+        rows.values(), ignore_conflicts=True
+    )
+    if not touched:
+        return 0
+
+    days = Q()
+    for category, day in touched:
+        days |= Q(category=category, date=day)
+    totals = list(
+        ledger.filter(days).values("category", "date") \
+            .annotate(amount=Sum("amount"), transactions=Count("id"))
+    )
+    PlaidCategorySpending.objects.bulk_create(
+        [
+            PlaidCategorySpending(
+                user_id=plaidItem.user_id,
+                item=plaidItem,
+                category=total["category"],
+                date=total["date"],
+                amount=total["amount"],
+                transactions=total["transactions"]
+            ) for total in totals
+        ],
+        update_conflicts=True,
+        unique_fields=["item", "category", "date"],
+        update_fields=["amount", "transactions"]
+    )
+    emptied = touched - {(total["category"], total["date"]) for total in totals}
+    if emptied:
+        days = Q()
+        for category, day in emptied:
+            days |= Q(category=category, date=day)
+        PlaidCategorySpending.objects.filter(item=plaidItem).filter(days).delete()
+    return len(touched)
+
+def category_spending(uid, start_date, end_date):
+    # ({category: amount}, first date, last date) over the window, in the 
+    # same shape as transactions_categories_sum
+    window = PlaidCategorySpending.objects.filter(
+        user_id=uid, date__gte=start_date, date__lte=end_date
+    )
+    spending_by_category = {
+        row["category"]: row["amount"] 
+        for row in window.values("category").annotate(amount=Sum("amount"))
+    }
+    dates = window.aggregate(min_date=Min("date"), max_date=Max("date"))
+    return spending_by_category, dates["min_date"], dates["max_date"]
+
+def seed_category_spending(uid, start_date, end_date, plaidItems):
+    # fill the ledger of items synced before it existed from transactions_get.
+    # each item's lock is held from the download to the write, so a sync 
+    # can't update the ledger in between. items that are syncing are left 
+    # unseeded for the next run
+    locks = {}
+    try:
+        for plaidItem in plaidItems:
+            lock = item_transactions_lock(plaidItem.itemId)
+            if lock.acquire():
+                locks[plaidItem.itemId] = lock
+        plaidItems = [
+            plaidItem for plaidItem in plaidItems if plaidItem.itemId in locks
+        ]
+        if not plaidItems:
+            return
+        transactions = transactions_get(
+            uid, start_date.strftime("%Y-%m-%d"), end_date.strftime("%Y-%m-%d"),
+            item_ids=[plaidItem.itemId for plaidItem in plaidItems]
+        )
+        if isinstance(transactions, str):
+            raise Exception(transactions)
+        for plaidItem in plaidItems:
+            pages = transactions.get(plaidItem.itemId, {})
+            with transaction.atomic():
+                for page_num in pages:
+                    update_category_spending(
+                        plaidItem, {"added": pages[page_num]["transactions"]}
+                    )
+                PlaidItem.objects.filter(pk=plaidItem.pk) \
+                    .update(categorySpendingSince=start_date)
+    finally:
+        for item_id, lock in locks.items():
+            release_item_transactions_lock(item_id, lock)
+
 @shared_task(name="transactions_get")
 @retry_on_db_error
 def transactions_get(uid, start_date_str, end_date_str, item_ids={}, page_size=100):
@@ -377,12 +486,10 @@ def transactions_get(uid, start_date_str, end_date_str, item_ids={}, page_size=1
         end_date = datetime.strptime(end_date_str, "%Y-%m-%d").date()
 
         plaidItems = PlaidItem.objects.filter(user__id=uid)
+        if item_ids:
+            plaidItems = plaidItems.filter(itemId__in=item_ids)
 
-        transactions_get_by_item = {}
-        
-        for plaidItem in plaidItems:
-            if item_ids and plaidItem.itemId not in item_ids:
-                continue
+        def transactions_get_item(plaidItem):
             offset = 0
             page = 0
             pages = {}
@@ -398,6 +505,7 @@ def transactions_get(uid, start_date_str, end_date_str, item_ids={}, page_size=1
                     )
                 )
                 
+                acquire_plaid_budget()
                 exchange_response = plaid_client.transactions_get(exchange_request)
                 serializer = TransactionsGetResponseSerializer(
                     data=exchange_response.to_dict()
@@ -409,8 +517,13 @@ def transactions_get(uid, start_date_str, end_date_str, item_ids={}, page_size=1
                 offset += page_size
                 page += 1
                 total_transactions = serializer.validated_data["total_transactions"]
-            transactions_get_by_item[plaidItem.itemId] = pages
+            return pages
 
+        transactions_get_by_item = {}
+        for plaidItem, pages, error in map_plaid_items(transactions_get_item, plaidItems):
+            if error:
+                raise error
+            transactions_get_by_item[plaidItem.itemId] = pages
         return transactions_get_by_item
     except ApiException as e:
         error = json.loads(e.body)
@@ -424,59 +537,29 @@ def transactions_get(uid, start_date_str, end_date_str, item_ids={}, page_size=1
 @retry_on_db_error
 def transactions_categories_sum(transactions_response, transactions_sync=True,
                                 personal_finance_categories=True):
-    plaid_category_detail_to_buul_categories = {
-        "FOOD_DRINK_AND_COFFEE": "dining",
-        "FOOD_DRINK_AND_FAST_FOOD": "dining",
-        "FOOD_AND_DRINK_RESTAURANT": "dining",
-        "FOOD_AND_DRINK_GROCERIES": "groceries",
-        "RENT_AND_UTILITIES_WATER": "utilities",
-        "RENT_AND_UTILITIES_TELEPHONE": "utilities",
-        "RENT_AND_UTILITIES_SEWAGE_AND_WASTE_TREATMENT": "utilities",
-        "RENT_AND_UTILITIES_INTERNET_AND_CABLE": "utilities",
-        "RENT_AND_UTILITIES_GAS_AND_ELECTRICITY": "utilities",
-        "TRAVEL_FLIGHTS": "travel",
-        "TRAVEL_LODGING": "travel"
-    }
-
-    counter_dict = {}
-    min_date = None
-    max_date = None
-    for item_id in transactions_response:
-        item = transactions_response[item_id]
-        for page_num in item:
-            page = item[page_num]
-            for transaction in page['added' if transactions_sync else 'transactions']:
-                amount = transaction['amount']
-                # check if valid
-                if transaction['pending'] == True or amount < 0:
-                    continue
-
-                if min_date is None or max_date is None:
-                    min_date = transaction["date"]
-                    max_date = transaction["date"]
-                elif transaction["date"] < min_date:
-                    min_date = transaction["date"]
-                elif transaction["date"] > max_date:
-                    max_date = transaction["date"]
-
-                detailed = transaction['personal_finance_category']['detailed']
-                categ = plaid_category_detail_to_buul_categories.get(detailed, None)
-                if categ and categ in counter_dict:
-                    counter_dict[categ] += amount
-                elif categ and categ not in counter_dict:
-                    counter_dict[categ] = amount
-                else: 
-                    continue
-    return counter_dict, min_date, max_date
+    return spending_by(
+        transactions_of(transactions_response, transactions_sync), 
+        transaction_category
+    )
 
 @shared_task(name="user_spending_by_category")
 @retry_on_db_error
 def user_spending_by_category(uid):
-    start_date_str = (timezone.now() - relativedelta(months=1)).strftime("%Y-%m-%d")
-    end_date_str = timezone.now().strftime("%Y-%m-%d")
-    transactions = transactions_get(uid, start_date_str, end_date_str)
-    spending_by_category, min_date, max_date = transactions_categories_sum(
-        transactions, transactions_sync=False
+    start_date = (timezone.now() - relativedelta(months=1)).date()
+    end_date = timezone.now().date()
+    start_date_str = start_date.strftime("%Y-%m-%d")
+    end_date_str = end_date.strftime("%Y-%m-%d")
+    # served from the ledger fed by transactions sync. only items whose 
+    # ledger doesn't reach back to the window are downloaded, once
+    unseeded = list(
+        PlaidItem.objects.filter(user__id=uid).filter(
+            Q(categorySpendingSince=None) | Q(categorySpendingSince__gt=start_date)
+        )
+    )
+    if unseeded:
+        seed_category_spending(uid, start_date, end_date, unseeded)
+    spending_by_category, min_date, max_date = category_spending(
+        uid, start_date, end_date
     )
 
     category_model_query = PlaidPersonalFinanceCategories.objects.filter(user__id=uid)
@@ -486,16 +569,109 @@ def user_spending_by_category(uid):
         category_model = PlaidPersonalFinanceCategories(
             user = User.objects.get(id=uid)
         )
-    for category in spending_by_category:
-        category_model[category] = spending_by_category[category]
+    for category in set(PLAID_CATEGORY_DETAIL_TO_BUUL_CATEGORIES.values()):
+        category_model[category] = spending_by_category.get(category, 0)
     category_model.start_date = start_date_str
     category_model.end_date = end_date_str
     category_model.save()
     
 
+# the weekly job shards users and runs the shards as a group. each shard 
+# checkpoints the users it has done, so a rerun in the same week (or a 
+# redelivered shard) resumes where it stopped
+
+def spending_by_category_checkpoint_name(run, shard):
+    return f"spending_by_category:{run}:{shard}"
+
 @shared_task(name="all_users_spending_by_category")
 @retry_on_db_error
-def all_users_spending_by_category():
-    for user in User.objects.all():
-        user_spending_by_category(user.id)
+def all_users_spending_by_category(shard_size=SPENDING_BY_CATEGORY_SHARD_SIZE):
+    year, week, _ = timezone.now().isocalendar()
+    run = f"{year}-W{week:02d}"
+
+    # checkpoints from earlier runs are finished with
+    TaskCheckpoint.objects.filter(name__startswith="spending_by_category:") \
+        .exclude(name__startswith=spending_by_category_checkpoint_name(run, "")) \
+        .delete()
+
+    # the shards already made this run keep their users. only users in none
+    # of them, e.g. those who signed up since, are split into new shards, so
+    # a rerun never moves a user between shards
+    checkpoints = {
+        int(checkpoint.name.rsplit(":", 1)[1]): checkpoint
+        for checkpoint in TaskCheckpoint.objects.filter(
+            name__startswith=spending_by_category_checkpoint_name(run, "")
+        )
+    }
+    assigned = {
+        uid for checkpoint in checkpoints.values() 
+        for uid in checkpoint.state["uids"]
+    }
+    uids = User.objects.order_by("id").values_list("id", flat=True) \
+        .iterator(chunk_size=shard_size)
+    shard = max(checkpoints, default=-1) + 1
+    batch = []
+    for uid in uids:
+        if str(uid) in assigned:
+            continue
+        batch.append(str(uid))
+        if len(batch) == shard_size:
+            checkpoints[shard] = new_spending_by_category_shard(run, shard, batch)
+            shard += 1
+            batch = []
+    if batch:
+        checkpoints[shard] = new_spending_by_category_shard(run, shard, batch)
+
+    pending = [
+        shard for shard, checkpoint in sorted(checkpoints.items())
+        if not checkpoint.state.get("finished")
+    ]
+    group(
+        user_spending_by_category_shard.s(run, shard) for shard in pending
+    ).apply_async()
+    return {"run": run, "shards": len(checkpoints), "dispatched": len(pending)}
+
+def new_spending_by_category_shard(run, shard, uids):
+    checkpoint, _ = TaskCheckpoint.objects.get_or_create(
+        name=spending_by_category_checkpoint_name(run, shard),
+        defaults={"state": {"uids": uids, "done": [], "failed": {}}}
+    )
+    return checkpoint
+
+@shared_task(name="user_spending_by_category_shard", acks_late=True)
+@retry_on_db_error
+def user_spending_by_category_shard(run, shard):
+    checkpoint = TaskCheckpoint.objects.get(
+        name=spending_by_category_checkpoint_name(run, shard)
+    )
+    state = checkpoint.state
+    done = set(state["done"])
+    start = time.monotonic()
+    processed = 0
+    for uid in state["uids"]:
+        if uid in done:
+            continue
+        try:
+            user_spending_by_category(uid)
+        except Exception as e:
+            if isinstance(e, OperationalError):
+                raise e
+            state["failed"][uid] = str(e)
+        state["done"].append(uid)
+        processed += 1
+        checkpoint.save(update_fields=["state", "updated_at"])
+
+    seconds = time.monotonic() - start
+    state["finished"] = True
+    state["seconds"] = state.get("seconds", 0) + seconds
+    state["users_per_second"] = processed / seconds if seconds else None
+    checkpoint.save(update_fields=["state", "updated_at"])
+    return {
+        "run": run,
+        "shard": shard,
+        "users": processed,
+        "failed": len(state["failed"]),
+        "seconds": seconds,
+        "users_per_second": state["users_per_second"]
+    }
 
@@ -2,17 +2,21 @@ from celery import shared_task
 from django.core.cache import cache 
 from django.utils import timezone
 from dateutil.relativedelta import relativedelta
-from django.db.models.signals import pre_save
+from django.db.models.signals import pre_save, post_save, post_delete
 from django.dispatch import receiver
 from django_celery_results.models import TaskResult
 
-from api.apis.plaid import plaid_client
+from api.apis.plaid import plaid_client, acquire_plaid_budget, \
+    map_plaid_items, TokenBucket, cache_lock
 from api.apis.sendgrid import sendgrid_client
 from sendgrid.helpers.mail import Mail
 from buul_backend.settings import NOTIFICATIONS_EMAIL
 
+from datetime import datetime, timedelta
 import re
 import json
+import math
+import threading
 import uuid
 
 from plaid.model.item_public_token_exchange_request import ItemPublicTokenExchangeRequest
@@ -21,6 +25,7 @@ from plaid.model.item_remove_request import ItemRemoveRequest
 from plaid.model.user_create_request import UserCreateRequest
 from plaid.model.user_remove_request import UserRemoveRequest
 from plaid.exceptions import ApiException
+from redis.exceptions import LockError
 from rest_framework.exceptions import ValidationError
 
 from plaid.model.item_access_token_invalidate_request import ItemAccessTokenInvalidateRequest
@@ -31,7 +36,11 @@ from ..serializers.plaid.item import ItemPublicTokenExchangeResponseSerializer,
 from ..serializers.plaid.link import LinkTokenCreateResponseSerializer
 from ..serializers.plaid.user import UserRemoveResponseSerializer, \
     UserCreateResponseSerializer
-from ..models import PlaidItem, PlaidUser, User
+from ..models import PlaidItem, PlaidUser, User, UserBrokerageInfo, \
+    TaskCheckpoint
+from robin_stocks.models import UserRobinhoodInfo
+from buul_backend.viewHelper import bump_resource_version
+from buul_backend.encryption import prefetch_deks
 
 from buul_backend.retry_db import retry_on_db_error
 
@@ -136,6 +145,7 @@ def plaid_item_get(**kwargs):
         for item_id in item_ids:
             plaid_item = PlaidItem.objects.get(user__id=uid, itemId=item_id)
             exchange_request = ItemGetRequest(access_token = plaid_item.accessToken)
+            acquire_plaid_budget()
             exchange_response = plaid_client.item_get(exchange_request)
             serializer = ItemGetResponseSerializer(
                 data=exchange_response.to_dict()
@@ -607,6 +617,7 @@ def plaid_access_token_refresh(plaid_item_id):
     #ApiException, ValidationError
     plaidItem = PlaidItem.objects.get(id=plaid_item_id)
     request = ItemAccessTokenInvalidateRequest(plaidItem.accessToken)
+    acquire_plaid_budget()
     exchange_response = plaid_client.item_access_token_invalidate(request)
     serializer = ItemAccessTokenInvalidateResponseSerializer(
         data=exchange_response.to_dict()
@@ -617,23 +628,137 @@ def plaid_access_token_refresh(plaid_item_id):
     plaidItem.previousRefreshSuccess = True
     plaidItem.save()
 
+# tokens are rotated every PLAID_TOKEN_ROTATION_DAYS. the hourly run takes 
+# the stalest share of items, so rotations are spread evenly over the day 
+# instead of arriving all at once
+
+PLAID_TOKEN_ROTATION_DAYS = 3
+PLAID_TOKEN_ROTATION_RUNS_PER_DAY = 24
+PLAID_TOKEN_ROTATION_RATE = 5.0 # rotations per second
+PLAID_TOKEN_ROTATION_MIN_RATE = 0.2
+PLAID_TOKEN_ROTATION_RATE_STEP = 0.5
+PLAID_TOKEN_ROTATION_MIN_BACKOFF = 60
+PLAID_TOKEN_ROTATION_MAX_BACKOFF = 3600
+PLAID_TOKEN_ROTATION_FAILURE_DELAY = timedelta(days=1)
+PLAID_TOKEN_ROTATION_LOCK_TIMEOUT = 10 * 60
+
+def plaid_access_token_rotation_quota(stale_before):
+    # at least an even share of all items, and enough to clear the stale 
+    # backlog within a day
+    total = PlaidItem.objects.count()
+    stale = PlaidItem.objects.filter(previousRefresh__lt=stale_before).count()
+    return max(
+        math.ceil(total / (PLAID_TOKEN_ROTATION_DAYS * PLAID_TOKEN_ROTATION_RUNS_PER_DAY)),
+        math.ceil(stale / PLAID_TOKEN_ROTATION_RUNS_PER_DAY)
+    )
+
 @shared_task(name="plaid_access_token_refresh_all")
 @retry_on_db_error
 def plaid_access_token_refresh_all():
-    plaidItems = PlaidItem.objects.filter(
-        previousRefresh__lt=timezone.now() - relativedelta(days=3)
+    # the hourly run and a backoff rerun each read the checkpoint when they 
+    # start and save it when they finish, so only one runs at a time
+    lock = cache_lock(
+        "plaid_access_token_rotation_lock", PLAID_TOKEN_ROTATION_LOCK_TIMEOUT
     )
+    if not lock.acquire():
+        return "rotation already running"
     try:
-        i = 0
-        for plaidItem in plaidItems:
+        return plaid_access_tokens_rotate(lock)
+    finally:
+        try:
+            lock.release()
+        except LockError:
+            pass # expired, and maybe taken by another run since
+
+def plaid_access_tokens_rotate(lock):
+    now = timezone.now()
+    checkpoint, _ = TaskCheckpoint.objects.get_or_create(
+        name="plaid_access_token_rotation"
+    )
+    state = checkpoint.state
+    backoff_until = state.get("backoff_until")
+    if backoff_until and datetime.fromisoformat(backoff_until) > now:
+        return f"rate limited, backing off until {backoff_until}"
+
+    # items that failed for reasons other than the rate limit wait a day 
+    # rather than taking the front of every run
+    failed = {
+        item_id: retry_at for item_id, retry_at in state.get("failed", {}).items()
+        if datetime.fromisoformat(retry_at) > now
+    }
+    stale_before = now - relativedelta(days=PLAID_TOKEN_ROTATION_DAYS)
+    plaidItems = list(
+        PlaidItem.objects.filter(previousRefresh__lt=stale_before) \
+            .exclude(id__in=failed.keys()) \
+            .order_by("previousRefresh")[:plaid_access_token_rotation_quota(stale_before)]
+    )
+    # old tokens' deks are unwrapped together up front, and the new tokens 
+    # are encrypted with each user's current dek
+    prefetch_deks(plaidItems, "accessTokenDek")
+
+    rate = state.get("rate", PLAID_TOKEN_ROTATION_RATE)
+    bucket = TokenBucket(rate)
+    rate_limited = threading.Event()
+    lock_lost = threading.Event()
+
+    def rotate(plaidItem):
+        if rate_limited.is_set() or lock_lost.is_set():
+            return False
+        try:
+            # kept for as long as items are being rotated
+            lock.extend(PLAID_TOKEN_ROTATION_LOCK_TIMEOUT, replace_ttl=True)
+        except LockError:
+            lock_lost.set()
+            return False
+        bucket.acquire()
+        try:
             plaid_access_token_refresh(plaidItem.id)
-            i += 1
-        return f"all remaining {i} tokens rotated"
-    except ApiException as e:
-        if e.error_code == "ITEM_ACCESS_TOKEN_INVALIDATE_LIMIT" and e.status == 429:
-            return f"rate limit exceeded, {i} tokens rotated"
-        else:
+        except ApiException as e:
+            if e.status == 429:
+                rate_limited.set()
+                return False
             raise e
+        return True
+
+    rotated, errors = 0, 0
+    for plaidItem, result, error in map_plaid_items(rotate, plaidItems):
+        if error is not None:
+            failed[str(plaidItem.id)] = \
+                (now + PLAID_TOKEN_ROTATION_FAILURE_DELAY).isoformat()
+            errors += 1
+        elif result:
+            rotated += 1
+
+    if lock_lost.is_set():
+        # another run owns the checkpoint now
+        return {"error": "rotation lock expired", "rotated": rotated, "failed": errors}
+
+    # additive increase, multiplicative decrease. when rate limited, the 
+    # rest of the items are picked up again once the backoff has passed
+    if rate_limited.is_set():
+        backoff = min(
+            max(2 * state.get("backoff", 0), PLAID_TOKEN_ROTATION_MIN_BACKOFF),
+            PLAID_TOKEN_ROTATION_MAX_BACKOFF
+        )
+        state["backoff"] = backoff
+        state["backoff_until"] = (now + timedelta(seconds=backoff)).isoformat()
+        state["rate"] = max(rate / 2, PLAID_TOKEN_ROTATION_MIN_RATE)
+        plaid_access_token_refresh_all.apply_async(countdown=backoff)
+    else:
+        state["backoff"] = 0
+        state["backoff_until"] = None
+        state["rate"] = min(
+            rate + PLAID_TOKEN_ROTATION_RATE_STEP, PLAID_TOKEN_ROTATION_RATE
+        )
+    state["failed"] = failed
+    checkpoint.save(update_fields=["state", "updated_at"])
+    return {
+        "rotated": rotated,
+        "failed": errors,
+        "skipped": len(plaidItems) - rotated - errors,
+        "rate_limited": rate_limited.is_set(),
+        "rate": state["rate"]
+    }
 
 
 # censor celery task result logs
@@ -693,9 +818,18 @@ def modify_task_result(sender, instance, **kwargs):
         instance.task_args = instance.task_args
 
 
-
-
-
-
-
-
+@receiver(post_save, sender=User)
+@receiver(post_save, sender=UserBrokerageInfo)
+@receiver(post_delete, sender=UserBrokerageInfo)
+@receiver(post_save, sender=UserRobinhoodInfo)
+@receiver(post_delete, sender=UserRobinhoodInfo)
+def bump_user_info_version(sender, instance, **kwargs):
+    uid = instance.id if sender is User else instance.user_id
+    bump_resource_version("user_info", uid)
+
+@receiver(post_save, sender=PlaidItem)
+@receiver(post_delete, sender=PlaidItem)
+def bump_plaid_items_version(sender, instance, **kwargs):
+    # user info reports whether any item is linked
+    bump_resource_version("plaid_items", instance.user_id)
+    bump_resource_version("user_info", instance.user_id)
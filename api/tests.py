@@ -25,7 +25,17 @@ from django.db import transaction
 from .tasks.user import plaid_item_public_tokens_exchange, \
     plaid_link_token_create, plaid_user_create, buul_user_remove, \
     plaid_user_remove, send_verification_code, send_waitlist_email, send_forgot_email
-from .tasks.identify import get_investment_graph_data
+from .spending import spending_by, transactions_of
+from .classifier import is_cashback, classify_batch
+from tests.cashback_corpus import CASHBACK_CORPUS
+from .jsonUtils import filter_jsons, get_nested
+from tests.filter_jsons_cases import filter_jsons_legacy, get_nested_legacy, \
+    transactions, CASES
+from itertools import product
+from datetime import date
+from buul_backend import encryption
+from buul_backend.encryption import LocalKMS, EnvelopeKeys
+from cryptography.exceptions import InvalidTag
 
 import time
 from django.core.mail import send_mail
@@ -169,6 +179,143 @@ class MyModelTestCase(TestCase):
 
 
 
+class ClassifierTestCase(TestCase):
+
+    def test_corpus(self):
+        for name, cashback in CASHBACK_CORPUS:
+            self.assertEqual(is_cashback(name), cashback, name)
+
+    def test_classify_batch_matches_is_cashback(self):
+        names = [name for name, _ in CASHBACK_CORPUS] + [None]
+        expected = [cashback for _, cashback in CASHBACK_CORPUS] + [False]
+        self.assertEqual(classify_batch(names).tolist(), expected)
+
+
+class FilterJsonsTestCase(TestCase):
+
+    def test_matches_legacy(self):
+        for case, kwargs in CASES.items():
+            kwargs = dict(kwargs)
+            jsons = kwargs.pop("documents", transactions)(200)
+            with self.subTest(case=case):
+                self.assertEqual(
+                    filter_jsons(jsons, **kwargs), 
+                    filter_jsons_legacy(jsons, **kwargs)
+                )
+
+    def test_get_nested_matches_search(self):
+        # same top-level shape, with the key in one or more nested places
+        nested = [
+            {"x": 0}, {"k": 1}, {"b": {"k": 2}}, {"b": {"x": 0}, "k": 3},
+            {"b": {"k": 4}, "y": {"k": 5}}, {"y": {"k": 6}, "b": {"k": 7}}, 
+            {"b": {"y": {"k": 8}}}
+        ]
+        jsons = [{"a": a, "c": c} for a, c in product(nested, repeat=2)]
+        for json in jsons:
+            self.assertEqual(
+                get_nested(json, "k"), get_nested_legacy(json, "k"), json
+            )
+
+
+class EncryptionTestCase(TestCase):
+
+    def test_local_kms_round_trip(self):
+        kms = LocalKMS()
+        dek = encryption.generate_dek()
+        for alias in ["buul", None]:
+            with self.subTest(alias=alias):
+                blob = kms.encrypt(
+                    KeyId=alias, Plaintext=dek, EncryptionContext={"user": "1"}
+                )["CiphertextBlob"]
+                self.assertEqual(
+                    kms.decrypt(
+                        CiphertextBlob=blob, EncryptionContext={"user": "1"}
+                    )["Plaintext"], 
+                    dek
+                )
+                with self.assertRaises(InvalidTag):
+                    kms.decrypt(CiphertextBlob=blob, EncryptionContext={"user": "2"})
+
+    def test_envelope_keys_zero_rotated_deks(self):
+        envelope_keys = EnvelopeKeys(max_uses=1)
+        dek, _ = envelope_keys.data_key(None, 1)
+        stored = envelope_keys.keys[(None, "1")]["dek"]
+        rotated, _ = envelope_keys.data_key(None, 1)
+        self.assertNotEqual(dek, rotated)
+        self.assertEqual(stored, bytes(len(dek)))
+        self.assertNotEqual(dek, bytes(len(dek)))
+
+
+class SpendingByTestCase(TestCase):
+
+    def transaction(self, amount, day, detailed, pending=False):
+        return {
+            "amount": amount,
+            "pending": pending,
+            "date": date(2025, 1, day),
+            "personal_finance_category": {
+                "primary": detailed.split("_")[0], "detailed": detailed
+            }
+        }
+
+    def response(self, key):
+        return {
+            "item_a": {
+                0: {key: [
+                    self.transaction(12.5, 3, "FOOD_AND_DRINK_GROCERIES"),
+                    self.transaction(40, 1, "TRAVEL_FLIGHTS", pending=True),
+                    self.transaction(-7, 2, "FOOD_AND_DRINK_GROCERIES"),
+                    self.transaction(9.99, 9, "GENERAL_MERCHANDISE_OTHER"),
+                ]},
+                1: {key: [
+                    self.transaction(0, 5, "TRAVEL_LODGING"),
+                    self.transaction(3.25, 4, "FOOD_AND_DRINK_GROCERIES"),
+                ]}
+            },
+            "item_b": {
+                0: {key: [
+                    self.transaction(-120, 28, "TRAVEL_FLIGHTS"),
+                    self.transaction(60, 6, "RENT_AND_UTILITIES_WATER", pending=True),
+                    self.transaction(18, 7, "FOOD_AND_DRINK_RESTAURANT"),
+                ]}
+            },
+            "item_c": {}
+        }
+
+    def test_buul_categories(self):
+        # pending transactions and refunds don't count, unmapped categories 
+        # only count towards the dates
+        expected = (
+            {"groceries": 15.75, "travel": 0.0, "dining": 18.0}, 
+            date(2025, 1, 3), date(2025, 1, 9)
+        )
+        for transactions_sync, key in [(True, "added"), (False, "transactions")]:
+            with self.subTest(transactions_sync=transactions_sync):
+                self.assertEqual(
+                    spending_by(transactions_of(self.response(key), transactions_sync)),
+                    expected
+                )
+
+    def test_any_key(self):
+        self.assertEqual(
+            spending_by(
+                transactions_of(self.response("added")), 
+                lambda t: t["personal_finance_category"]["primary"]
+            ),
+            (
+                {"FOOD": 33.75, "GENERAL": 9.99, "TRAVEL": 0.0}, 
+                date(2025, 1, 3), date(2025, 1, 9)
+            )
+        )
+
+    def test_nothing_spent(self):
+        self.assertEqual(
+            spending_by([self.transaction(5, 8, "TRAVEL_FLIGHTS", pending=True)]),
+            ({}, None, None)
+        )
+        self.assertEqual(spending_by([]), ({}, None, None))
+
+
 # def test_login(uid):
 # 	import pdb; breakpoint()
 	# login_res = r.login(
@@ -27,8 +27,9 @@ from celery import current_app, chain, chord
 from .tasks.user import plaid_item_public_tokens_exchange, \
     plaid_link_token_create, plaid_user_create, buul_user_remove, \
     plaid_user_remove, send_verification_code, send_waitlist_email, send_forgot_email
-from .tasks.graph import refresh_stock_data_by_interval, get_graph_data
-from .tasks.identify import update_transactions
+from .tasks.graph import refresh_stock_data_by_interval, get_graph_data, \
+    graph_series
+from .tasks.identify import request_transactions_update
 from .tasks.deposit import match_brokerage_plaid_accounts
 from robin_stocks.models import UserRobinhoodInfo
 
@@ -43,7 +44,7 @@ from .serializers.buul import MyTokenObtainPairSerializer
 import bcrypt 
 
 from buul_backend.viewHelper import LogState, log, validate, \
-    cached_task_logging_info
+    cached_task_logging_info, conditional_request
 
 
 # helper methods
@@ -769,7 +770,7 @@ class PlaidItemWebhook(APIView):
             
             item_id = serializer.validated_data["item_id"]
 
-            update_transactions.apply_async(args = [item_id])
+            request_transactions_update(item_id)
 
             status = 200
             log(Log, self, status, webhook_code)#LogState.SUCCESS)
@@ -985,6 +986,13 @@ class GetUserInfo(APIView):
 
     def get(self, request, *args, **kwargs):
         user = self.request.user
+        not_modified_response, cache_headers = conditional_request(
+            self.request, user.id, "user_info"
+        )
+        if not_modified_response:
+            log(Log, self, 304, LogState.NOT_MODIFIED)
+            return not_modified_response
+
         try:
             userBrokerageInfo = UserBrokerageInfo.objects.get(user__id=user.id)
             brokerage = userBrokerageInfo.brokerage
@@ -1001,7 +1009,7 @@ class GetUserInfo(APIView):
         
         status = 200
         log(Log, self, status, LogState.SUCCESS)
-        return JsonResponse(
+        response = JsonResponse(
             {
                 "full_name": user.full_name,
                 "email": user.email,
@@ -1014,24 +1022,37 @@ class GetUserInfo(APIView):
             }, 
             status = status
         )
+        for header, value in cache_headers.items():
+            response[header] = value
+        return response
 
 class GetPlaidItems(APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request, *args, **kwargs):
         user = self.request.user
+        not_modified_response, cache_headers = conditional_request(
+            self.request, user.id, "plaid_items"
+        )
+        if not_modified_response:
+            log(Log, self, 304, LogState.NOT_MODIFIED)
+            return not_modified_response
+
         plaid_items = PlaidItem.objects.filter(user=user)
         institution_names = [i.institution_name for i in plaid_items if i.institution_name]
         
         status = 200
         log(Log, self, status, LogState.SUCCESS)
-        return JsonResponse(
+        response = JsonResponse(
             {
                 "institution_names": institution_names,
                 "error": None
             }, 
             status = status
         )
+        for header, value in cache_headers.items():
+            response[header] = value
+        return response
   
 
 class StockGraphData(APIView):
@@ -1062,7 +1083,8 @@ class StockGraphData(APIView):
         # breakpoint()
         serializer = GraphDataRequestSerializer(data=request.data)
         validation_error_response = validate(
-            Log, serializer, self, fields_to_correct=["start_date"], 
+            Log, serializer, self, 
+            fields_to_correct=["start_date", "resolution", "max_points"], 
             fields_to_fail=["non_field_errors"]
         )
         if validation_error_response:
@@ -1080,6 +1102,28 @@ class StockGraphData(APIView):
                     json.loads(task_status), 
                     status = status
                 )
+            not_modified_response, cache_headers = conditional_request(
+                self.request, uid, "graph", 
+                params={
+                    "start_date": start_date.isoformat(),
+                    "resolution": serializer.validated_data.get("resolution"),
+                    "max_points": serializer.validated_data.get("max_points")
+                }
+            )
+            if not_modified_response:
+                log(Log, self, 304, LogState.NOT_MODIFIED)
+                return not_modified_response
+            elif "resolution" in serializer.validated_data \
+                    or "max_points" in serializer.validated_data:
+                data = graph_series(
+                    uid, 
+                    FPMUtils.round_date_down(start_date, granularity="1min"),
+                    resolution=serializer.validated_data.get("resolution"),
+                    max_points=serializer.validated_data.get("max_points")
+                )
+                status = 200
+                log(Log, self, status, LogState.SUCCESS, errors)
+                response = JsonResponse({"data": data}, status=status)
             else:
                 query = UserInvestmentGraph.objects.filter(
                     user__id=uid,
@@ -1093,7 +1137,10 @@ class StockGraphData(APIView):
                     })
                 status = 200
                 log(Log, self, status, LogState.SUCCESS, errors)
-                return JsonResponse({"data": data}, status=status)
+                response = JsonResponse({"data": data}, status=status)
+            for header, value in cache_headers.items():
+                response[header] = value
+            return response
         else:
             status = 200
             error_message = "no cache value found"
@@ -3,6 +3,8 @@ from celery import Celery
 from .settings import SQS_LONG_RUNNING_URL, SQS_USER_INTERACTION_URL, SQS_DLQ_URL, SQS_CONTROL_URL, REDIS_URL
 import django
 from kombu import Queue
+from celery.signals import task_prerun, task_postrun
+from .encryption import secret_cache_scope
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'buul_backend.settings')
 # django.setup()
@@ -21,6 +23,7 @@ app.conf.imports = [
     "api.tasks.deposit",
     "api.tasks.identify",
     "api.tasks.graph",
+    "api.tasks.anonymize",
     "robin_stocks.tasks",
 ]
 
@@ -41,3 +44,19 @@ app.conf.worker_prefetch_multiplier = 1
 app.conf.redbeat_redis_url = REDIS_URL
 
 #app.conf.control_queue = 'ab-control'
+
+
+# decrypted secrets are cached per task, like per request in the middleware
+secret_cache_scopes = {}
+
+@task_prerun.connect
+def open_secret_cache(task_id=None, **kwargs):
+    scope = secret_cache_scope()
+    scope.__enter__()
+    secret_cache_scopes[task_id] = scope
+
+@task_postrun.connect
+def close_secret_cache(task_id=None, **kwargs):
+    scope = secret_cache_scopes.pop(task_id, None)
+    if scope is not None:
+        scope.__exit__(None, None, None)
@@ -1,12 +1,25 @@
 from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar, copy_context
+from concurrent.futures import ThreadPoolExecutor
+import json
 import os
+import threading
+import time
 
 # comments are used in production to use AWS KMS  
 
 def generate_dek():
     return os.urandom(32)
 def encrypt_dek(plaintext_dek, alias, context=None):
-    encrypted_dek = plaintext_dek
+    if kms is not None:
+        return kms.encrypt(
+            KeyId=alias,
+            Plaintext=bytes(plaintext_dek),
+            EncryptionContext=context or {}
+        )["CiphertextBlob"]
+    encrypted_dek = bytes(plaintext_dek)
     return encrypted_dek
     # kms = boto3.client('kms')
     # encrypted = kms.encrypt(
@@ -23,11 +36,16 @@ def encrypt_data(plaintext_dek, data):
     return data_blob
 def encrypt(model_instance, value, field_name, dek_field_name,
             context_fields=[], alias=None):
-    dek = generate_dek()
+    # the dek is shared by the instance's user (or the alias if it has none)
+    # for a rotation window, instead of being generated and wrapped per write
+    tenant = getattr(model_instance, "user_id", None)
+    dek, encrypted_dek = envelope_keys.data_key(alias, tenant)
     data_blob = encrypt_data(dek, value)
     object.__setattr__(model_instance, f"_{field_name}", data_blob)
-    encrypted_dek = encrypt_dek(dek, alias)
     object.__setattr__(model_instance, dek_field_name, encrypted_dek)
+    cache = secret_cache.get()
+    if cache is not None:
+        cache.get(encrypted_dek, lambda _: dek)
 
 def parse_data_blob(data_blob):
     iv = data_blob[:12]
@@ -35,6 +53,11 @@ def parse_data_blob(data_blob):
     data_ciphertext = data_blob[28:]
     return iv, tag, data_ciphertext
 def decrypt_dek(encrypted_dek, context=None):
+    if kms is not None:
+        return kms.decrypt(
+            CiphertextBlob=bytes(encrypted_dek),
+            EncryptionContext=context or {}
+        )["Plaintext"]
     decrypted_dek = encrypted_dek
     return decrypted_dek 
     # kms = boto3.client('kms')
@@ -50,11 +73,214 @@ def decrypt(model_instance, field_name, dek_field_name,
             context_fields=[], alias=None):
     data_blob = model_instance.__dict__[f"_{field_name}"]
     iv, tag, data_ciphertext = parse_data_blob(data_blob)
-    dek = decrypt_dek(model_instance.__dict__[dek_field_name])
+    encrypted_dek = model_instance.__dict__[dek_field_name]
+    cache = secret_cache.get()
+    if cache is None:
+        dek = decrypt_dek(encrypted_dek)
+    else:
+        dek = cache.get(bytes(encrypted_dek), decrypt_dek)
     data = decrypt_data(dek, iv, tag, data_ciphertext)
     return data.decode("utf-8")
 
 
+# decrypted deks are cached for the length of a request or task, so each 
+# secret is unwrapped at most once per unit of work. outside of a 
+# secret_cache_scope nothing is cached
 
+SECRET_CACHE_TTL = 300
+SECRET_CACHE_SIZE = 256
 
+secret_cache = ContextVar("secret_cache", default=None)
+secret_cache_metrics = {"hits": 0, "misses": 0, "evictions": 0}
+secret_cache_metrics_lock = threading.Lock()
 
+class SecretCache:
+    def __init__(self, ttl=SECRET_CACHE_TTL, maxsize=SECRET_CACHE_SIZE):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # shared with the threads a unit of work fans out to
+        self.lock = threading.Lock()
+
+    def get(self, encrypted_dek, unwrap):
+        # callers get a copy, so zeroing an entry never changes a key in use
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(encrypted_dek)
+            if entry is not None and entry[1] > now:
+                self.entries.move_to_end(encrypted_dek)
+                self.hits += 1
+                return bytes(entry[0])
+            if entry is not None:
+                self.evict(encrypted_dek)
+        dek = bytearray(unwrap(encrypted_dek))
+        with self.lock:
+            self.misses += 1
+            if encrypted_dek in self.entries:
+                self.evict(encrypted_dek)
+            self.entries[encrypted_dek] = (dek, now + self.ttl)
+            while len(self.entries) > self.maxsize:
+                self.evict(next(iter(self.entries)))
+            return bytes(dek)
+
+    def evict(self, encrypted_dek):
+        dek, _ = self.entries.pop(encrypted_dek)
+        # zero the plaintext dek before dropping it
+        dek[:] = bytes(len(dek))
+        self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            while self.entries:
+                self.evict(next(iter(self.entries)))
+
+@contextmanager
+def secret_cache_scope(ttl=SECRET_CACHE_TTL, maxsize=SECRET_CACHE_SIZE):
+    cache = SecretCache(ttl, maxsize)
+    token = secret_cache.set(cache)
+    try:
+        yield cache
+    finally:
+        secret_cache.reset(token)
+        cache.clear()
+        with secret_cache_metrics_lock:
+            secret_cache_metrics["hits"] += cache.hits
+            secret_cache_metrics["misses"] += cache.misses
+            secret_cache_metrics["evictions"] += cache.evictions
+
+class SecretCacheMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with secret_cache_scope():
+            return self.get_response(request)
+
+
+# envelope encryption. kms is the client deks are wrapped with; None keeps 
+# the passthrough above. LocalKMS stands in for it offline, e.g.
+# encryption.kms = LocalKMS()
+
+kms = None
+
+DEK_ROTATION = 3600
+DEK_MAX_USES = 2 ** 20
+KMS_MAX_WORKERS = 8
+
+class LocalKMS:
+    # same encrypt/decrypt calls as the boto3 kms client, with master keys 
+    # held in memory
+    def __init__(self, master_keys=None):
+        self.master_keys = master_keys or {}
+        self.lock = threading.Lock()
+
+    def master_key(self, alias):
+        with self.lock:
+            if alias not in self.master_keys:
+                self.master_keys[alias] = generate_dek()
+            return self.master_keys[alias]
+
+    def encrypt(self, KeyId, Plaintext, EncryptionContext=None):
+        # the alias as recorded in the blob, so decrypt finds the same key
+        alias = str(KeyId)
+        iv = os.urandom(12)
+        encryptor = Cipher(
+            algorithms.AES(self.master_key(alias)), modes.GCM(iv)
+        ).encryptor()
+        encryptor.authenticate_additional_data(
+            json.dumps(EncryptionContext or {}, sort_keys=True).encode("utf-8")
+        )
+        ciphertext = encryptor.update(Plaintext) + encryptor.finalize()
+        alias = alias.encode("utf-8")
+        return {
+            "CiphertextBlob": len(alias).to_bytes(2, "big") + alias + iv \
+                + encryptor.tag + ciphertext
+        }
+
+    def decrypt(self, CiphertextBlob, EncryptionContext=None):
+        alias_length = int.from_bytes(CiphertextBlob[:2], "big")
+        alias = CiphertextBlob[2:2 + alias_length].decode("utf-8")
+        iv, tag, ciphertext = parse_data_blob(CiphertextBlob[2 + alias_length:])
+        decryptor = Cipher(
+            algorithms.AES(self.master_key(alias)), modes.GCM(iv, tag)
+        ).decryptor()
+        decryptor.authenticate_additional_data(
+            json.dumps(EncryptionContext or {}, sort_keys=True).encode("utf-8")
+        )
+        return {"Plaintext": decryptor.update(ciphertext) + decryptor.finalize()}
+
+class EnvelopeKeys:
+    # a wrapped dek per (alias, tenant), reused until it is DEK_ROTATION 
+    # seconds old or has encrypted DEK_MAX_USES values. plaintext deks are 
+    # zeroed once rotated out, and callers get copies
+    def __init__(self, rotation=DEK_ROTATION, max_uses=DEK_MAX_USES):
+        self.rotation = rotation
+        self.max_uses = max_uses
+        self.keys = {}
+        self.lock = threading.Lock()
+
+    def data_key(self, alias, tenant=None):
+        key = (alias, str(tenant) if tenant is not None else None)
+        now = time.monotonic()
+        with self.lock:
+            entry = self.keys.get(key)
+            if entry is not None and entry["expires"] > now \
+                    and entry["uses"] < self.max_uses:
+                entry["uses"] += 1
+                return bytes(entry["dek"]), entry["encrypted_dek"]
+        dek = bytearray(generate_dek())
+        encrypted_dek = encrypt_dek(dek, alias)
+        with self.lock:
+            if key in self.keys:
+                self.evict(key)
+            # keys are inserted in expiry order, so expired ones, e.g. of 
+            # tenants that stopped writing, are at the front
+            while self.keys:
+                oldest = next(iter(self.keys))
+                if self.keys[oldest]["expires"] > now:
+                    break
+                self.evict(oldest)
+            self.keys[key] = {
+                "dek": dek,
+                "encrypted_dek": encrypted_dek,
+                "expires": now + self.rotation,
+                "uses": 1
+            }
+            return bytes(dek), encrypted_dek
+
+    def evict(self, key):
+        entry = self.keys.pop(key)
+        entry["dek"][:] = bytes(len(entry["dek"]))
+
+    def clear(self):
+        with self.lock:
+            while self.keys:
+                self.evict(next(iter(self.keys)))
+
+envelope_keys = EnvelopeKeys()
+
+def prefetch_deks(model_instances, dek_field_name, max_workers=KMS_MAX_WORKERS):
+    # unwrap the distinct deks of model_instances concurrently into the 
+    # current secret cache, so decrypting them makes no further kms calls
+    cache = secret_cache.get()
+    if cache is None:
+        return 0
+    # no more than the cache holds, or the first would be evicted by the last
+    encrypted_deks = list(dict.fromkeys(
+        bytes(model_instance.__dict__[dek_field_name])
+        for model_instance in model_instances
+    ))[:cache.maxsize]
+    if not encrypted_deks:
+        return 0
+    contexts = [copy_context() for _ in encrypted_deks]
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(encrypted_deks))) as executor:
+        list(executor.map(
+            lambda context, encrypted_dek: context.run(
+                cache.get, encrypted_dek, decrypt_dek
+            ),
+            contexts, encrypted_deks
+        ))
+    return len(encrypted_deks)
@@ -1,8 +1,20 @@
 from enum import Enum
-from django.http import JsonResponse
+from django.http import JsonResponse, HttpResponseNotModified
+from django.core.cache import cache
+from django.utils.http import http_date, parse_http_date_safe
+from django.db import connection
 from rest_framework.exceptions import ValidationError
-from django.db.utils import OperationalError
+from django.db.utils import OperationalError, IntegrityError, DataError
+from queue import Queue, Full, Empty
+import atexit
+import hashlib
 import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
 
 class LogState(Enum):
     VAL_ERR_MESSAGE = "failed_validation_with_error_message"
@@ -17,6 +29,7 @@ class LogState(Enum):
     BACKGROUND_TASK_NO_CACHE = "no_cache_soexpired_or_error"
     INTERNAL_ERR = "internal_error"
     RH_MFA = "rh_req"
+    NOT_MODIFIED = "not_modified"
 
 
 def cached_task_logging_info(cached_string):
@@ -60,7 +73,138 @@ def log(logger, instance, status, state, errors=None, user=None,
         status = status,
         pre_account_id = pre_account_id
     )
-    log.save()
+    log_buffer.put(log)
+
+
+class LogBuffer:
+    # logs are written in batches by a background thread, off the request 
+    # path. when the queue is full for longer than put_timeout, logs are 
+    # dropped and counted rather than slowing requests down. the counts of 
+    # every process add up in the cache, under log_buffer_written and 
+    # log_buffer_dropped
+    def __init__(self, maxsize=10000, batch_size=500, flush_interval=1.0, 
+                 put_timeout=0.01):
+        self.queue = Queue(maxsize=maxsize)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.put_timeout = put_timeout
+        self.written = 0
+        self.dropped = 0
+        self.published = {"log_buffer_written": 0, "log_buffer_dropped": 0}
+        self.closing = False
+        self.reset_locks()
+        self.thread = None
+        self.pid = None
+        os.register_at_fork(after_in_child=self.reset_locks)
+        atexit.register(self.close)
+
+    def reset_locks(self):
+        # a forked child may inherit them held by the parent's flusher
+        self.lock = threading.Lock()
+        # held by whoever has logs taken off the queue but not yet written
+        self.write_lock = threading.Lock()
+
+    def put(self, log):
+        self.start()
+        try:
+            self.queue.put(log, timeout=self.put_timeout)
+        except Full:
+            self.count(dropped=1)
+
+    def start(self):
+        # a forked worker inherits the queue but not the flusher thread
+        if self.pid == os.getpid() and self.thread.is_alive():
+            return
+        with self.lock:
+            if self.pid == os.getpid() and self.thread.is_alive():
+                return
+            self.pid = os.getpid()
+            self.thread = threading.Thread(
+                target=self.run, name="log-flusher", daemon=True
+            )
+            self.thread.start()
+
+    def run(self):
+        while not self.closing:
+            with self.write_lock:
+                batch = []
+                deadline = time.monotonic() + self.flush_interval
+                while len(batch) < self.batch_size:
+                    try:
+                        batch.append(self.queue.get(timeout=max(0, deadline - time.monotonic())))
+                    except Empty:
+                        break
+                if batch:
+                    self.write(batch)
+            if batch:
+                self.publish()
+                # the flusher's own connection; reopened for the next batch
+                connection.close()
+
+    def flush(self):
+        # write whatever is queued, after the batch the flusher is on
+        with self.write_lock:
+            batch = []
+            while True:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except Empty:
+                    break
+            for i in range(0, len(batch), self.batch_size):
+                self.write(batch[i:i + self.batch_size])
+
+    def close(self):
+        # on worker shutdown. the flusher stops once its batch is written
+        self.closing = True
+        self.flush()
+        self.publish()
+
+    def write(self, batch):
+        logs_by_model = {}
+        for log in batch:
+            logs_by_model.setdefault(type(log), []).append(log)
+        for model, logs in logs_by_model.items():
+            try:
+                model.objects.bulk_create(logs)
+                self.count(written=len(logs))
+            except (IntegrityError, DataError):
+                # one bad row fails the whole insert, so find it
+                for log in logs:
+                    try:
+                        model.objects.bulk_create([log])
+                        self.count(written=1)
+                    except Exception as e:
+                        logger.warning(
+                            f"dropped {model.__name__} {getattr(log, 'name', None)}: {e}"
+                        )
+                        self.count(dropped=1)
+            except Exception as e:
+                logger.warning(f"dropped {len(logs)} {model.__name__} rows: {e}")
+                self.count(dropped=len(logs))
+
+    def count(self, written=0, dropped=0):
+        with self.lock:
+            self.written += written
+            self.dropped += dropped
+
+    def publish(self):
+        # add this process's counts since the last publish to the cache
+        with self.lock:
+            counts = {
+                "log_buffer_written": self.written - self.published["log_buffer_written"],
+                "log_buffer_dropped": self.dropped - self.published["log_buffer_dropped"]
+            }
+        for key, n in counts.items():
+            if not n:
+                continue
+            try:
+                cache.add(key, 0, timeout=None)
+                cache.incr(key, n)
+                self.published[key] += n
+            except Exception:
+                pass # retried with the next batch
+
+log_buffer = LogBuffer()
 
 def validate(logger, serializer, instance, fields_to_correct=[], fields_to_fail=[],
              correct_all = False, fail_all = False, 
@@ -123,3 +267,54 @@ def validate(logger, serializer, instance, fields_to_correct=[], fields_to_fail=
         )
 
 
+
+
+def bump_resource_version(resource, uid=None):
+    # every write to a user's resource (or, without uid, to everyone's) 
+    # makes a new version, so cached copies stop matching
+    key = f"uid_{uid}_{resource}_version" if uid else f"{resource}_version"
+    cache.set(key, time.time(), timeout=None)
+
+def resource_version(uid, resource):
+    # one round trip for the user's and the global stamp. a user stamp that 
+    # was never written (or was evicted) starts a new version now
+    user_key = f"uid_{uid}_{resource}_version"
+    versions = cache.get_many([user_key, f"{resource}_version"])
+    if user_key not in versions:
+        versions[user_key] = time.time()
+        if not cache.add(user_key, versions[user_key], timeout=None):
+            versions[user_key] = cache.get(user_key, versions[user_key])
+    return max(versions.values())
+
+def conditional_request(request, uid, resource, params=None):
+    # (304 response or None, headers to set on the full response). clients 
+    # revalidate every time, but an unchanged resource costs a redis read
+    version = resource_version(uid, resource)
+    etag = '"' + hashlib.sha1(
+        json.dumps([resource, version, params], sort_keys=True, default=str).encode()
+    ).hexdigest() + '"'
+    headers = {
+        "ETag": etag,
+        "Last-Modified": http_date(version),
+        "Cache-Control": "private, no-cache"
+    }
+
+    if_none_match = request.headers.get("If-None-Match")
+    if if_none_match:
+        tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        not_modified = etag in tags or "*" in tags
+    else:
+        if_modified_since = parse_http_date_safe(
+            request.headers.get("If-Modified-Since", "")
+        )
+        # to the second, as the header is (ETags are exact). the date says 
+        # nothing about params, so only parameterless reads can use it
+        not_modified = if_modified_since is not None \
+            and params is None and int(version) <= if_modified_since
+    if not not_modified:
+        return None, headers
+
+    response = HttpResponseNotModified()
+    for header, value in headers.items():
+        response[header] = value
+    return response, headers
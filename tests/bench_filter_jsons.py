@@ -0,0 +1,27 @@
+# filter_jsons against the per-json, per-predicate implementation it replaced,
+# on synthetic plaid-shaped transactions. correctness is covered by 
+# FilterJsonsTestCase in api/tests.py.
+# run from the repo root: python tests/bench_filter_jsons.py [n_transactions]
+import os, sys; sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import time
+from api.jsonUtils import filter_jsons
+from tests.filter_jsons_cases import filter_jsons_legacy, transactions, CASES
+
+
+def bench(n):
+    print(f"|{'case':^20}|{'legacy s':^12}|{'compiled s':^12}|{'speedup':^10}|")
+    print(f"|{'_'*20}|{'_'*12}|{'_'*12}|{'_'*10}|")
+    for case, kwargs in CASES.items():
+        kwargs = dict(kwargs)
+        jsons = kwargs.pop("documents", transactions)(n)
+        start = time.perf_counter()
+        legacy = filter_jsons_legacy(jsons, **kwargs)
+        legacy_time = time.perf_counter() - start
+        start = time.perf_counter()
+        compiled = filter_jsons(jsons, **kwargs)
+        compiled_time = time.perf_counter() - start
+        print(f"|{case:<20}|{legacy_time:<12.4f}|{compiled_time:<12.4f}|{legacy_time / compiled_time:<10.2f}|")
+
+
+if __name__ == "__main__":
+    bench(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000)
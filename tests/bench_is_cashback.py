@@ -0,0 +1,42 @@
+# throughput of the cashback classifier against the per-call regex build it 
+# replaced. correctness is covered by ClassifierTestCase in api/tests.py.
+# run from the repo root: python tests/bench_is_cashback.py [n_names]
+import os, sys; sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import re
+import time
+import numpy as np
+from api.classifier import is_cashback, classify_batch, KEYWORDS_INCLUDE, \
+    KEYWORDS_REJECT
+from tests.cashback_corpus import CASHBACK_CORPUS
+
+
+def is_cashback_legacy(name):
+    match_pattern = '|'.join(map(re.escape, KEYWORDS_INCLUDE))
+    is_match = re.search(match_pattern, name) is not None
+    reject_pattern = '|'.join(map(re.escape, KEYWORDS_REJECT))
+    is_reject = re.search(reject_pattern, name) is not None 
+    return is_match and not is_reject
+
+def timed(func, names):
+    start = time.perf_counter()
+    result = func(names)
+    return time.perf_counter() - start, result
+
+def bench(n_names):
+    rng = np.random.default_rng(0)
+    corpus_names = [name for name, _ in CASHBACK_CORPUS]
+    names = [corpus_names[i] for i in rng.integers(len(corpus_names), size=n_names)]
+
+    legacy_time, legacy = timed(lambda names: [is_cashback_legacy(n) for n in names], names)
+    single_time, single = timed(lambda names: [is_cashback(n) for n in names], names)
+    batch_time, batch = timed(classify_batch, names)
+
+    print(f"|{'impl':^16}|{'seconds':^12}|{'names/s':^14}|{'speedup':^10}|")
+    print(f"|{'_'*16}|{'_'*12}|{'_'*14}|{'_'*10}|")
+    for impl, seconds in [("legacy", legacy_time), ("is_cashback", single_time), 
+                          ("classify_batch", batch_time)]:
+        print(f"|{impl:<16}|{seconds:<12.6f}|{n_names / seconds:<14.0f}|{legacy_time / seconds:<10.2f}|")
+
+
+if __name__ == "__main__":
+    bench(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000)
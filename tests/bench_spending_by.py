@@ -0,0 +1,105 @@
+# spending_by against the per-row loop transactions_categories_sum used to
+# run, on synthetic plaid-shaped transactions get responses. checks both
+# return the same sums and date range.
+# run from the repo root: python tests/bench_spending_by.py [n_transactions]
+import os, sys; sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import time
+import numpy as np
+from datetime import date, timedelta
+from api.spending import spending_by, transactions_of, transaction_category, \
+    PLAID_CATEGORY_DETAIL_TO_BUUL_CATEGORIES
+
+
+def transactions_categories_sum_legacy(transactions_response, transactions_sync=True):
+    counter_dict = {}
+    min_date = None
+    max_date = None
+    for item_id in transactions_response:
+        item = transactions_response[item_id]
+        for page_num in item:
+            page = item[page_num]
+            for transaction in page['added' if transactions_sync else 'transactions']:
+                amount = transaction['amount']
+                if transaction['pending'] == True or amount < 0:
+                    continue
+
+                if min_date is None or max_date is None:
+                    min_date = transaction["date"]
+                    max_date = transaction["date"]
+                elif transaction["date"] < min_date:
+                    min_date = transaction["date"]
+                elif transaction["date"] > max_date:
+                    max_date = transaction["date"]
+
+                detailed = transaction['personal_finance_category']['detailed']
+                categ = PLAID_CATEGORY_DETAIL_TO_BUUL_CATEGORIES.get(detailed, None)
+                if categ and categ in counter_dict:
+                    counter_dict[categ] += amount
+                elif categ and categ not in counter_dict:
+                    counter_dict[categ] = amount
+    return counter_dict, min_date, max_date
+
+def transactions_response(n, n_items=4, page_size=100):
+    # {item_id: {page: {"transactions": [...]}}}, as transactions_get returns.
+    # about a third are refunds, a ninth pending, and some categories unmapped
+    rng = np.random.default_rng(0)
+    detailed = list(PLAID_CATEGORY_DETAIL_TO_BUUL_CATEGORIES) \
+        + ["GENERAL_MERCHANDISE_OTHER", "TRANSFER_IN_DEPOSIT"]
+    amounts = rng.normal(30, 60, size=n)
+    categories = rng.integers(len(detailed), size=n)
+    days = rng.integers(31, size=n)
+    start = date(2025, 1, 1)
+    transactions = [
+        {
+            "transaction_id": f"txn_{i}",
+            "amount": float(amounts[i]),
+            "pending": bool(i % 9 == 0),
+            "date": start + timedelta(days=int(days[i])),
+            "personal_finance_category": {
+                "primary": detailed[categories[i]].split("_")[0],
+                "detailed": detailed[categories[i]],
+                "confidence_level": "HIGH"
+            }
+        }
+        for i in range(n)
+    ]
+    response = {}
+    for item in range(n_items):
+        item_transactions = transactions[item::n_items]
+        response[f"item_{item}"] = {
+            page: {"transactions": item_transactions[offset:offset + page_size]}
+            for page, offset in enumerate(range(0, len(item_transactions), page_size))
+        }
+    return response
+
+def bench(n, repeats=5):
+    response = transactions_response(n)
+    impls = [
+        ("legacy", lambda: transactions_categories_sum_legacy(response, False)),
+        ("spending_by", lambda: spending_by(
+            transactions_of(response, False), transaction_category
+        )),
+        # any grouping key, e.g. plaid's primary category
+        ("by primary", lambda: spending_by(
+            transactions_of(response, False),
+            lambda t: t["personal_finance_category"]["primary"]
+        ))
+    ]
+    times, results = {}, {}
+    for impl, func in impls:
+        # best of repeats, the first run also pays for warming caches
+        times[impl] = float("inf")
+        for _ in range(repeats):
+            start = time.perf_counter()
+            results[impl] = func()
+            times[impl] = min(times[impl], time.perf_counter() - start)
+    assert results["legacy"] == results["spending_by"], results
+
+    print(f"|{'impl':^12}|{'seconds':^12}|{'rows/s':^14}|{'speedup':^10}|")
+    print(f"|{'_'*12}|{'_'*12}|{'_'*14}|{'_'*10}|")
+    for impl, _ in impls:
+        print(f"|{impl:<12}|{times[impl]:<12.6f}|{n / times[impl]:<14.0f}|{times['legacy'] / times[impl]:<10.2f}|")
+
+
+if __name__ == "__main__":
+    bench(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000)
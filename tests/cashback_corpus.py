@@ -0,0 +1,43 @@
+# regression corpus for api.classifier: (transaction name, is cashback).
+# add a sample here for every misclassified transaction found with
+# tests/is_cashback.py before changing the keyword lists
+
+CASHBACK_CORPUS = [
+    # cashback
+    ("CASHBACK REDEMPTION", True),
+    ("CASH BACK REWARD", True),
+    ("CASH AUTO REDEMPTION", True),
+    ("CASH REWARD REDEMPTION 0412", True),
+    ("CASHREWARD STATEMENT", True),
+    ("CASH AWARD", True),
+    ("CASHBACK BONUS", True),
+    ("CASHBACK REWARDS", True),
+    ("REWARDS DEPOSIT 123456", True),
+    ("REWARDS CREDIT", True),
+    ("REWARDS REDEMPTION", True),
+    ("STATEMENT CREDIT", True),
+    ("CREDIT- REWARD", True),
+    ("CREDIT REWARD RDM", True),
+    ("WELLS FARGO REWARDS", True),
+    ("BANK OF AMERICA CREDIT CRD DES:RWRD ID:XXXXX", True),
+    ("DISCOVER CASHBACK BONUS DEPOSIT", True),
+    # not cashback
+    ("Uber 063015 SF**POOL**", False),
+    ("United Airlines", False),
+    ("McDonald's", False),
+    ("Starbucks", False),
+    ("SparkFun", False),
+    ("Touchstone Climbing", False),
+    ("KFC", False),
+    ("CD DEPOSIT .INITIAL.", False),
+    ("INTRST PYMNT", False),
+    ("AUTOMATIC PAYMENT - THANK", False),
+    ("CASHIER CHECK", False),
+    ("ATM CASH WITHDRAWAL", False),
+    ("ZELLE CASHBACK FROM JOHN", False),
+    ("CASH BACK AT BILL PAY", False),
+    ("CITY CASH REWARD PROGRAM", False),
+    ("DIRECT DEP REWARDS DEPOSIT", False),
+    ("cashback redemption", False),
+    ("", False),
+]
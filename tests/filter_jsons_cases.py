@@ -0,0 +1,114 @@
+# the implementation filter_jsons replaced and the documents it is compared
+# on, by FilterJsonsTestCase in api/tests.py and tests/bench_filter_jsons.py
+import types
+import numpy as np
+from queue import Queue
+
+
+def filter_jsons_legacy(jsons, eq={}, neq={}, gt={}, lt={}, lte={}, gte={}, 
+                        metric_to_return_by=None, **kwargs):
+    filter_sets = [eq, neq, gt, lt, lte, gte]
+    operations = ["eq", "neq", "gt", "lt", "lte", "gte"]
+    for kwarg in kwargs:
+        operations.append(kwargs[kwarg]["func"]) 
+        filter_sets.append(kwargs[kwarg]["filter_set"])
+    filtered_jsons = {} if metric_to_return_by else []
+    for json in jsons:
+        match = True
+        for filter_set, op in zip(filter_sets, operations):
+            for metric in filter_set:
+                metric_val = get_nested_legacy(json, metric)
+                if metric_val is None:
+                    continue
+                for filter_val in filter_set[metric]:
+                    if not comparison_operation_legacy(metric_val, filter_val, op): 
+                        match = False
+                        break
+                if not match:
+                    break
+            if not match:
+                break
+        if match:
+            if metric_to_return_by:
+                key = get_nested_legacy(json, metric_to_return_by)
+                filtered_jsons.setdefault(key, []).append(json)
+            else:
+                filtered_jsons.append(json)
+    return filtered_jsons
+
+def comparison_operation_legacy(arg1, arg2, op):        
+    if op == "eq":
+        return arg1 == arg2
+    if op == "neq":
+        return arg1 != arg2
+    elif op == "gt":
+        return arg1 > arg2
+    elif op == "lt":
+        return arg1 < arg2
+    elif op == "lte":
+        return arg1 <= arg2
+    elif op == "gte":
+        return arg1 >= arg2
+    elif isinstance(op, types.FunctionType):
+        return op(arg1, arg2)
+
+def get_nested_legacy(json, key):
+    queue = Queue()
+    queue.put(json)
+    while queue.qsize() > 0:
+        current = queue.get()
+        for key_ in current:
+            if key_ == key:
+                return current[key]
+            if isinstance(current[key_], dict):
+                queue.put(current[key_])
+    return
+
+def transactions(n):
+    rng = np.random.default_rng(0)
+    names = ["CASHBACK REDEMPTION", "Starbucks", "United Airlines", "ZELLE FROM J"]
+    return [
+        {
+            "transaction_id": f"txn_{i}",
+            "account_id": f"acct_{i % 7}",
+            "amount": float(rng.normal(0, 50)),
+            "name": names[i % len(names)],
+            "pending": bool(i % 5 == 0),
+            "date": f"2025-{1 + i % 12:02d}-{1 + i % 28:02d}",
+            "location": {"city": None, "region": None, "country": "US"},
+            "personal_finance_category": {
+                "primary": ["FOOD_AND_DRINK", "TRAVEL", "TRANSFER_IN"][i % 3],
+                "detailed": "FOOD_AND_DRINK_COFFEE",
+                "confidence_level": "HIGH"
+            },
+            "counterparties": [],
+        }
+        for i in range(n)
+    ]
+
+def orders(n):
+    # robinhood-order-shaped: the filtered metric sits under a few nested dicts
+    return [
+        {
+            "id": f"order_{i}",
+            "account": {"url": f"acct_{i % 3}", "margin": {"limit": None}},
+            "instrument": {"symbol": "VOO", "quote": {"bid": 1.0, "ask": 1.1}},
+            "executions": {"first": {"price": 1.0}, "last": {"price": 1.0}},
+            "fees": {"regulatory": {"sec": 0.0, "taf": 0.0}},
+            "state": {"summary": {"status": ["filled", "cancelled"][i % 2]}},
+        }
+        for i in range(n)
+    ]
+
+CASES = {
+    "cashback candidates": dict(
+        lt={"amount": [0]}, 
+        is_cashback={
+            "func": lambda name, bool: ("CASHBACK" in name) == bool, 
+            "filter_set": {"name": [True]}
+        }
+    ),
+    "by account": dict(eq={"pending": [False]}, metric_to_return_by="account_id"),
+    "nested metric": dict(eq={"primary": ["TRAVEL"]}, gte={"amount": [-20]}),
+    "deep nested metric": dict(eq={"status": ["filled"]}, documents=orders),
+}